@@ -0,0 +1,77 @@
+"""
+    Prediction backends used by the Classifier. A backend takes an image and
+    returns a dictionary with labels and their probabilities. The backend is
+    selected with setup.PREDICTION_BACKEND.
+"""
+from typing import Dict
+from utilities import setup
+
+
+class PredictionBackend:
+    """
+        Interface for prediction backends. Subclasses implement
+        predict_image() and predict_image_url().
+    """
+
+    def predict_image(self, img, iteration_name: str) -> Dict[str, float]:
+        """
+            Returns labels and assosiated probabilities for the image read
+            from the file handle img.
+        """
+        raise NotImplementedError
+
+    def predict_image_url(
+        self, img_url: str, iteration_name: str
+    ) -> Dict[str, float]:
+        """
+            Returns labels and assosiated probabilities for the image read
+            from img_url.
+        """
+        raise NotImplementedError
+
+
+class CustomVisionBackend(PredictionBackend):
+    """
+        Sends images to the published iteration in Azure Custom Vision.
+    """
+
+    def __init__(self, predictor, project_id: str) -> None:
+        self.predictor = predictor
+        self.project_id = project_id
+
+    def predict_image(self, img, iteration_name: str) -> Dict[str, float]:
+        res = self.predictor.classify_image_with_no_store(
+            self.project_id, iteration_name, img
+        )
+        return dict([(i.tag_name, i.probability) for i in res.predictions])
+
+    def predict_image_url(
+        self, img_url: str, iteration_name: str
+    ) -> Dict[str, float]:
+        res = self.predictor.classify_image_url(
+            self.project_id, iteration_name, img_url
+        )
+        return dict([(i.tag_name, i.probability) for i in res.predictions])
+
+
+def get_backend(name: str, predictor, project_id: str) -> PredictionBackend:
+    """
+        Returns the prediction backend with the given name.
+
+        Parameters:
+        name: "customvision" or "onnx"
+        predictor: CustomVisionPredictionClient used by the Azure backend
+        project_id: Custom Vision project id
+
+        Returns:
+        PredictionBackend
+    """
+    if name == "customvision":
+        return CustomVisionBackend(predictor, project_id)
+    elif name == "onnx":
+        # onnxruntime is optional, only import it when it is used
+        from customvision.onnx_backend import OnnxBackend
+
+        return OnnxBackend(setup.ONNX_MODEL_PATH, setup.ONNX_LABELS_PATH)
+    else:
+        raise ValueError("Unknown prediction backend: " + str(name))
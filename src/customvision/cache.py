@@ -0,0 +1,99 @@
+"""
+    Least recently used cache for predictions. Entries are keyed on a
+    perceptual hash of the image together with the iteration name, so
+    identical or nearly identical drawings are only sent to the prediction
+    backend once per iteration.
+"""
+import threading
+from collections import OrderedDict
+from PIL import Image
+
+
+class PredictionCache:
+    """
+        Thread safe LRU cache with hit and miss counters.
+    """
+
+    def __init__(self, max_size: int) -> None:
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.__entries = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def get(self, key):
+        """
+            Returns the cached value for key, or None if it is not cached.
+        """
+        with self.__lock:
+            value = self.__entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+
+            self.__entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value) -> None:
+        """
+            Caches value for key, evicting the least recently used entries
+            when the cache is full.
+        """
+        with self.__lock:
+            self.__entries[key] = value
+            self.__entries.move_to_end(key)
+            while len(self.__entries) > self.max_size:
+                self.__entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        """
+            Returns the size of the cache and the hit and miss counters.
+        """
+        with self.__lock:
+            return {
+                "size": len(self.__entries),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+def grayscale(image: Image.Image) -> Image.Image:
+    """
+        Converts the image to grayscale. Transparent pixels are treated as
+        white canvas.
+    """
+    if image.mode in ("RGBA", "LA", "P"):
+        image = image.convert("RGBA")
+        background = Image.new("RGBA", image.size, (255, 255, 255, 255))
+        image = Image.alpha_composite(background, image)
+
+    return image.convert("L")
+
+
+def image_hash(image: Image.Image, hash_size: int) -> int:
+    """
+        Returns a perceptual hash of the decoded image. The image is
+        downscaled to (hash_size + 1) x (hash_size + 1) grayscale, which
+        makes the hash insensitive to small differences like antialiasing
+        noise. The hash combines the horizontal and the vertical difference
+        hash, so strokes in either direction are seen, with one bit per
+        pixel darker than the mean, which tells apart thin and thick
+        strokes.
+    """
+    side = hash_size + 1
+    small = grayscale(image).resize((side, side), Image.BILINEAR)
+    pixels = small.tobytes()
+    mean = sum(pixels) / len(pixels)
+    bits = 0
+    for row in range(hash_size):
+        offset = row * side
+        for col in range(hash_size):
+            pixel = pixels[offset + col]
+            right = pixels[offset + col + 1]
+            below = pixels[offset + side + col]
+            bits = (bits << 1) | (pixel > right)
+            bits = (bits << 1) | (pixel > below)
+            bits = (bits << 1) | (pixel < mean)
+
+    return bits
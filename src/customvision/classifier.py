@@ -3,35 +3,40 @@
     Tools for interacting with Azure Custom Vision and Azure Blob Storage
 """
 import uuid
+import json
 import time
 import sys
 import os
+import threading
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
 from typing import Dict
 from typing import List
+from urllib.parse import unquote
+from PIL import Image
 from webapp import models
 from webapp import api
+from customvision import backend
+from customvision.cache import PredictionCache
+from customvision.cache import image_hash
 from werkzeug import exceptions as excp
-from msrest.authentication import ApiKeyCredentials
-from azure.storage.blob import BlobServiceClient
-from azure.cognitiveservices.vision.customvision.prediction import (
-    CustomVisionPredictionClient,
-)
-from azure.cognitiveservices.vision.customvision.training import (
-    CustomVisionTrainingClient,
-)
+from msrest.exceptions import HttpOperationError
 from azure.cognitiveservices.vision.customvision.training.models import (
     ImageUrlCreateEntry,
     CustomVisionErrorException,
 )
 
 from utilities.keys import Keys
+from utilities import clients
 from utilities import setup
 
 
 class Classifier:
     """
-        Class for interacting with Custom Vision. Contatins three key methods:
+        Class for interacting with Custom Vision. Contatins four key methods:
             - predict_imgage() / predicts a an image
+            - predict_batch() / predicts many images concurrently
             - upload_images() / reads image URLs from Blob Storage and uploads to Custom Vision
             - train() / trains a model
     """
@@ -54,23 +59,49 @@ class Classifier:
         self.base_img_url = Keys.get("BASE_BLOB_URL")
         self.prediction_resource_id = Keys.get("CV_PREDICTION_RESOURCE_ID")
 
-        self.prediction_credentials = ApiKeyCredentials(
-            in_headers={"Prediction-key": self.prediction_key}
-        )
-        self.predictor = CustomVisionPredictionClient(
-            self.ENDPOINT, self.prediction_credentials
-        )
-        self.training_credentials = ApiKeyCredentials(
-            in_headers={"Training-key": self.training_key}
-        )
-        self.trainer = CustomVisionTrainingClient(
-            self.ENDPOINT, self.training_credentials
-        )
-        connect_str = Keys.get("BLOB_CONNECTION_STRING")
-        self.blob_service_client = BlobServiceClient.from_connection_string(
-            connect_str
+        self.predictor = clients.prediction_client()
+        self.backend = backend.get_backend(
+            setup.PREDICTION_BACKEND, self.predictor, self.project_id
         )
+        self.prediction_cache = PredictionCache(setup.PREDICTION_CACHE_SIZE)
+        self.trainer = clients.training_client()
+        self.blob_service_client = clients.blob_service_client()
+
+        # the iteration name is read from the database on first use, so
+        # creating a classifier makes no remote calls
+        self.__iteration_lock = threading.Lock()
+        self.__iteration_refreshing = False
+        self.iteration_name = None
+        self.iteration_fetched = time.monotonic()
+
+    def get_iteration_name(self) -> str:
+        """
+            Returns the name of the iteration used for predictions. The name
+            is cached for setup.ITERATION_CACHE_TTL seconds. An expired name
+            is still returned while it is refreshed from the database in the
+            background, so predictions never wait for the database. Other
+            workers pick up a newly published iteration within the TTL.
+        """
+        if self.iteration_name is None:
+            self.__load_iteration_name()
+
+        age = time.monotonic() - self.iteration_fetched
+        if age > setup.ITERATION_CACHE_TTL:
+            with self.__iteration_lock:
+                if not self.__iteration_refreshing:
+                    self.__iteration_refreshing = True
+                    threading.Thread(
+                        target=self.__refresh_iteration_name, daemon=True
+                    ).start()
 
+        return self.iteration_name
+
+    def sync_iteration_name(self) -> str:
+        """
+            Finds the latest published iteration in Custom Vision, stores it
+            in the database and uses it for predictions. Called once per
+            deployment by webapp.init, as listing the iterations is slow.
+        """
         # get all project iterations
         iterations = self.trainer.get_iterations(self.project_id)
         # find published iterations
@@ -81,10 +112,49 @@ class Classifier:
         ]
         # get the latest published iteration
         puplished_iterations.sort(key=lambda i: i.created)
-        self.iteration_name = puplished_iterations[-1].publish_name
-
+        iteration_name = puplished_iterations[-1].publish_name
         with api.app.app_context():
-            models.update_iteration_name(self.iteration_name)
+            models.update_iteration_name(iteration_name)
+
+        self.set_iteration_name(iteration_name)
+        return iteration_name
+
+    def set_iteration_name(self, iteration_name: str) -> None:
+        """
+            Updates the cached iteration name and resets its TTL.
+        """
+        self.iteration_name = str(iteration_name)
+        self.iteration_fetched = time.monotonic()
+
+    def __load_iteration_name(self) -> None:
+        """
+            Reads the iteration name from the database on first use. Falls
+            back to Custom Vision if the database has none, e.g. when
+            webapp.init has not been run.
+        """
+        with self.__iteration_lock:
+            if self.iteration_name is not None:
+                return
+
+            try:
+                with api.app.app_context():
+                    self.set_iteration_name(models.get_iteration_name())
+            except AttributeError:
+                self.sync_iteration_name()
+
+    def __refresh_iteration_name(self) -> None:
+        """
+            Reads the iteration name from the database into the cache.
+        """
+        try:
+            with api.app.app_context():
+                self.set_iteration_name(models.get_iteration_name())
+        except Exception as e:
+            # keep the old name and try again when the TTL has expired
+            self.iteration_fetched = time.monotonic()
+            api.app.logger.error(e)
+        finally:
+            self.__iteration_refreshing = False
 
     def predict_image_url(self, img_url: str) -> Dict[str, float]:
         """
@@ -97,17 +167,14 @@ class Classifier:
             (prediction (dict[str,float]): labels and assosiated probabilities,
             best_guess: (str): name of the label with highest probability)
         """
-        with api.app.app_context():
-            self.iteration_name = models.get_iteration_name()
-        res = self.predictor.classify_image_url(
-            self.project_id, self.iteration_name, img_url
+        pred_kv = self.backend.predict_image_url(
+            img_url, self.get_iteration_name()
         )
-        pred_kv = dict([(i.tag_name, i.probability) for i in res.predictions])
         best_guess = max(pred_kv, key=pred_kv.get)
 
         return pred_kv, best_guess
 
-    def predict_image(self, img) -> Dict[str, float]:
+    def predict_image(self, img, image=None) -> Dict[str, float]:
         """
             Predicts label(s) of Image read from URL.
             ASSUMES:
@@ -117,44 +184,125 @@ class Classifier:
 
             Parameters:
             img_url: .png file
+            image: img already decoded with PIL, decoded here if not given
 
             Returns:
             (prediction (dict[str,float]): labels and assosiated probabilities,
             best_guess: (str): name of the label with highest probability)
         """
-        with api.app.app_context():
-            self.iteration_name = models.get_iteration_name()
-        res = self.predictor.classify_image_with_no_store(
-            self.project_id, self.iteration_name, img
-        )
+        iteration_name = self.get_iteration_name()
+        # identical or nearly identical drawings are only predicted once
+        if image is None:
+            image = Image.open(img)
+
+        key = (image_hash(image, setup.PREDICTION_HASH_SIZE), iteration_name)
+        img.seek(0)
+        cached = self.prediction_cache.get(key)
+        if cached is not None:
+            pred_kv, best_guess = cached
+            return dict(pred_kv), best_guess
+
+        pred_kv = self.backend.predict_image(img, iteration_name)
         # reset the file head such that it does not affect the state of the file handle
         img.seek(0)
-        pred_kv = dict([(i.tag_name, i.probability) for i in res.predictions])
         best_guess = max(pred_kv, key=pred_kv.get)
-        return pred_kv, best_guess
+        self.prediction_cache.put(key, (pred_kv, best_guess))
+        return dict(pred_kv), best_guess
 
-    def __chunks(self, lst, n):
+    def predict_batch(self, images, iteration_name=None, workers=None):
         """
-            Helper method used by upload_images() to upload URL chunks of 64, which is maximum chunk size in Azure Custom Vision.
-        """
-        for i in range(0, len(lst), n):
-            yield lst[i : i + n]
+            Predicts many images with a bounded pool of threads. Requests
+            that are throttled by Custom Vision are retried with exponential
+            backoff.
+
+            Parameters:
+            images: iterable of image URLs or paths to .png files
+            iteration_name: published iteration to use, defaults to the
+            current one
+            workers: number of threads, defaults to setup.CV_BATCH_WORKERS
 
-    def upload_images(self, labels: List, container_name) -> None:
+            Returns:
+            generator of (image, prediction, best_guess) in the order the
+            predictions complete. prediction and best_guess are None if the
+            image could not be predicted.
+        """
+        iteration_name = iteration_name or self.get_iteration_name()
+        workers = workers or setup.CV_BATCH_WORKERS
+        images = iter(images)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = {}
+            while True:
+                # keep the number of queued images bounded
+                while len(pending) < 2 * workers:
+                    image = next(images, None)
+                    if image is None:
+                        break
+
+                    future = executor.submit(
+                        self.__predict_with_backoff, image, iteration_name
+                    )
+                    pending[future] = image
+
+                if not pending:
+                    return
+
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    image = pending.pop(future)
+                    try:
+                        pred_kv = future.result()
+                    except Exception as e:
+                        print(f"Could not predict {image}: {e}")
+                        yield image, None, None
+                        continue
+
+                    yield image, pred_kv, max(pred_kv, key=pred_kv.get)
+
+    def __predict_with_backoff(self, image, iteration_name):
+        """
+            Predicts a single image URL or file path, retrying throttled
+            requests. The Retry-After header is used when it is provided.
+        """
+        for attempt in range(setup.CV_MAX_RETRIES + 1):
+            try:
+                if image.startswith(("http://", "https://")):
+                    return self.backend.predict_image_url(
+                        image, iteration_name
+                    )
+
+                with open(image, "rb") as img:
+                    return self.backend.predict_image(img, iteration_name)
+            except HttpOperationError as e:
+                response = getattr(e, "response", None)
+                is_throttled = getattr(response, "status_code", None) == 429
+                if not is_throttled or attempt == setup.CV_MAX_RETRIES:
+                    raise
+
+                delay = setup.CV_BACKOFF_DELAY * 2 ** attempt
+                retry_after = response.headers.get("Retry-After", "")
+                if retry_after.isdigit():
+                    delay = max(delay, int(retry_after))
+
+                time.sleep(delay)
+
+    def upload_images(
+        self, labels: List, container_name, progress=None
+    ) -> None:
         """
             Takes as input a list of labels, uploads all assosiated images to Azure Custom Vision project.
             If label in input already exists in Custom Vision project, all images are uploaded directly.
             If label in input does not exist in Custom Vision project, new label (Tag object in Custom Vision) is created before uploading images
+            Blobs are listed for all labels concurrently and every full chunk is uploaded by a pool of threads as soon as it is ready.
+            Images uploaded earlier are recorded in a manifest per container and skipped.
 
             Parameters:
             labels (str[]): List of labels
+            container_name (str): Container with the images
+            progress: optional function called with a status message
 
             Returns:
             None
         """
-        url_list = []
-        existing_tags = list(self.trainer.get_tags(self.project_id))
-
         try:
             container = self.blob_service_client.get_container_client(
                 container_name
@@ -165,6 +313,111 @@ class Classifier:
                 str(e),
             )
 
+        tags = self.__get_tags(labels)
+        manifest = self.__load_manifest(container_name)
+        counts = {"OK": 0, "OKDuplicate": 0, "failed": 0, "skipped": 0}
+        error_messages = set()
+        lock = threading.Lock()
+
+        def upload_chunk(chunk):
+            """
+                Uploads a chunk of {url: (blob name, tag id)} and records
+                the result.
+            """
+            entries = [
+                ImageUrlCreateEntry(url=url, tag_ids=[tag_id])
+                for url, (name, tag_id) in chunk.items()
+            ]
+            upload_result = self.trainer.create_images_from_urls(
+                self.project_id, images=entries
+            )
+            # the returned source_url may be encoded differently than sent
+            names = dict(
+                [(unquote(url), name) for url, (name, tag_id) in chunk.items()]
+            )
+            with lock:
+                for image in upload_result.images:
+                    if image.status not in ("OK", "OKDuplicate"):
+                        error_messages.add(image.status)
+                        counts["failed"] += 1
+                        continue
+
+                    counts[image.status] += 1
+                    name = names.get(unquote(image.source_url or ""))
+                    if name is None:
+                        print(f"\nUnknown source url: {image.source_url}")
+                    else:
+                        manifest.add(name)
+
+                # a crash keeps the progress of the finished chunks
+                self.__save_manifest(container_name, manifest)
+                self.__print_upload_progress(counts)
+                if progress is not None:
+                    progress(
+                        f"Uploaded {counts['OK'] + counts['OKDuplicate']} "
+                        f"images, {counts['failed']} failed"
+                    )
+
+        def list_label(label, upload_executor):
+            """
+                Lists the blobs of a label and submits a chunk for upload
+                every time CV_MAX_IMAGES new images are found.
+            """
+            blob_prefix = f"{label}/"
+            blob_list = container.list_blobs(name_starts_with=blob_prefix)
+            futures = []
+            chunk = {}
+            for blob in blob_list:
+                if blob.name in manifest:
+                    with lock:
+                        counts["skipped"] += 1
+                    continue
+
+                # build correct URLs
+                blob_url = f"{self.base_img_url}/{container_name}/{blob.name}"
+                chunk[blob_url] = (blob.name, tags[label].id)
+                if len(chunk) == setup.CV_MAX_IMAGES:
+                    futures.append(upload_executor.submit(upload_chunk, chunk))
+                    chunk = {}
+
+            if chunk:
+                futures.append(upload_executor.submit(upload_chunk, chunk))
+
+            return futures
+
+        print("Uploading images from blob to CV")
+        workers = setup.CV_UPLOAD_WORKERS
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as upload_executor:
+                with ThreadPoolExecutor(max_workers=workers) as list_executor:
+                    listings = [
+                        list_executor.submit(list_label, label, upload_executor)
+                        for label in tags
+                    ]
+                    uploads = [
+                        future
+                        for listing in listings
+                        for future in listing.result()
+                    ]
+
+                for upload in uploads:
+                    upload.result()
+        finally:
+            self.__save_manifest(container_name, manifest)
+
+        print()
+        if len(error_messages) > 0:
+            print("Error messages:")
+            for error_message in error_messages:
+                print(f"\t {error_message}")
+
+    def __get_tags(self, labels: List) -> Dict:
+        """
+            Returns a dictionary from label to Tag object, creating the tags
+            that don't exist in the Custom Vision project.
+        """
+        existing_tags = list(self.trainer.get_tags(self.project_id))
+        tags = {}
         for label in labels:
             # check if input has correct type
             if not isinstance(label, str):
@@ -182,64 +435,64 @@ class Classifier:
             else:
                 tag = tag[0]
 
-            blob_prefix = f"{label}/"
-            blob_list = container.list_blobs(name_starts_with=blob_prefix)
+            tags[label] = tag
 
-            if not blob_list:
-                raise AttributeError("no images for this label")
+        return tags
 
-            # build correct URLs and append to URL list
-            for blob in blob_list:
-                blob_url = f"{self.base_img_url}/{container_name}/{blob.name}"
-                url_list.append(
-                    ImageUrlCreateEntry(url=blob_url, tag_ids=[tag.id])
-                )
+    def __print_upload_progress(self, counts):
+        """
+            Prints the number of uploaded, duplicate, failed and skipped
+            images on one line.
+        """
+        print(
+            f"\t succesfull: \033[92m {counts['OK']:5d} \033]92m \033[0m",
+            f"\t duplicates: \033[33m {counts['OKDuplicate']:5d} \033]33m \033[0m",
+            f"\t failed: \033[91m {counts['failed']:5d} \033]91m \033[0m",
+            f"\t skipped: {counts['skipped']:5d}",
+            sep="",
+            end="\r",
+            flush=True,
+        )
 
-        # upload URLs in chunks of 64
-        print("Uploading images from blob to CV")
-        img_f = 0
-        img_s = 0
-        img_d = 0
-        itr_img = 0
-        chunks = self.__chunks(url_list, setup.CV_MAX_IMAGES)
-        num_imgs = len(url_list)
-        error_messages = set()
-        for url_chunk in chunks:
-            upload_result = self.trainer.create_images_from_urls(
-                self.project_id, images=url_chunk
-            )
-            if not upload_result.is_batch_successful:
-                for image in upload_result.images:
-                    if image.status == "OK":
-                        img_s += 1
-                    elif image.status == "OKDuplicate":
-                        img_d += 1
-                    else:
-                        error_messages.add(image.status)
-                        img_f += 1
+    def __manifest_path(self, container_name):
+        """
+            Returns the path of the upload manifest for the container.
+        """
+        return os.path.join(setup.UPLOAD_MANIFEST_DIR, f"{container_name}.json")
 
-                    itr_img += 1
-            else:
-                batch_size = len(upload_result.images)
-                img_s += batch_size
-                itr_img += batch_size
+    def __load_manifest(self, container_name):
+        """
+            Returns the set of blob names already uploaded from the container.
+        """
+        path = self.__manifest_path(container_name)
+        if not os.path.isfile(path):
+            return set()
 
-            prc = itr_img / num_imgs
-            print(
-                f"\t succesfull: \033[92m {img_s:5d} \033]92m \033[0m",
-                f"\t duplicates: \033[33m {img_d:5d} \033]33m \033[0m",
-                f"\t failed: \033[91m {img_f:5d} \033]91m \033[0m",
-                f"\t [{prc:03.2%}]",
-                sep="",
-                end="\r",
-                flush=True,
-            )
+        with open(path) as manifest_file:
+            return set(json.load(manifest_file))
 
-        print()
-        if len(error_messages) > 0:
-            print("Error messages:")
-            for error_message in error_messages:
-                print(f"\t {error_message}")
+    def __save_manifest(self, container_name, manifest):
+        """
+            Stores the set of uploaded blob names for the container.
+        """
+        os.makedirs(setup.UPLOAD_MANIFEST_DIR, exist_ok=True)
+        path = self.__manifest_path(container_name)
+        with open(path + ".tmp", "w") as manifest_file:
+            json.dump(sorted(manifest), manifest_file)
+        os.replace(path + ".tmp", path)
+
+    def clear_manifests(self) -> None:
+        """
+            Forgets which images have been uploaded, so the next upload sends
+            all images again. Used when all images are deleted in Custom
+            Vision.
+        """
+        if not os.path.isdir(setup.UPLOAD_MANIFEST_DIR):
+            return
+
+        for file_name in os.listdir(setup.UPLOAD_MANIFEST_DIR):
+            if file_name.endswith(".json"):
+                os.remove(os.path.join(setup.UPLOAD_MANIFEST_DIR, file_name))
 
     def get_iteration(self):
         iterations = self.trainer.get_iterations(self.project_id)
@@ -259,12 +512,22 @@ class Classifier:
             self.trainer.unpublish_iteration(self.project_id, oldest_iteration)
             self.trainer.delete_iteration(self.project_id, oldest_iteration)
 
-    def train(self, labels: list) -> None:
+    def train(self, labels: list, progress=None) -> None:
         """
             Trains model on all labels specified in input list, exeption is raised by self.trainer.train_projec() is asked to train on non existent labels.
             Generates unique iteration name, publishes model and sets self.iteration_name if successful.
             Parameters:
             labels (str[]): List of labels
+            progress: optional function called with a status message
+        """
+        iteration = self.start_training()
+        iteration = self.wait_for_training(iteration.id, progress)
+        self.publish(iteration)
+
+    def start_training(self):
+        """
+            Deletes the oldest iteration if needed and starts training a new
+            iteration. Returns the iteration, which is still training.
         """
         try:
             email = Keys.get("EMAIL")
@@ -274,29 +537,63 @@ class Classifier:
 
         self.delete_iteration()
         print("Training...")
-        iteration = self.trainer.train_project(
+        return self.trainer.train_project(
             self.project_id,
             reserved_budget_in_hours=1,
             notification_email_address=email,
         )
-        # Wait for training to complete
+
+    def training_iteration(self):
+        """
+            Returns the latest iteration that is still training, or None.
+            Used to adopt a training started by a worker that died before
+            it could record the iteration.
+        """
+        iterations = [
+            iteration
+            for iteration in self.trainer.get_iterations(self.project_id)
+            if iteration.status == "Training"
+        ]
+        if not iterations:
+            return None
+
+        return max(iterations, key=lambda i: i.created)
+
+    def wait_for_training(self, iteration_id, progress=None):
+        """
+            Polls the iteration with exponential backoff until training is
+            completed. Returns the trained iteration.
+        """
         start = time.time()
-        while iteration.status != "Completed":
+        iteration = None
+
+        def is_trained():
+            nonlocal iteration
             iteration = self.trainer.get_iteration(
-                self.project_id, iteration.id
+                self.project_id, iteration_id
             )
             minutes, seconds = divmod(time.time() - start, 60)
+            message = f"Training status: {iteration.status}"
             print(
-                f"Training status: {iteration.status}",
+                message,
                 f"\t[{minutes:02.0f}m:{seconds:02.0f}s]",
                 end="\r",
             )
-            time.sleep(1)
+            if progress is not None:
+                progress(message)
+
+            return iteration.status == "Completed"
 
+        self.__poll(is_trained)
         print()
+        return iteration
 
-        # The iteration is now trained. Publish it to the project endpoint
-        iteration_name = uuid.uuid4()
+    def publish(self, iteration) -> None:
+        """
+            Publishes the trained iteration to the project endpoint under a
+            unique name, and makes it the iteration used for predictions.
+        """
+        iteration_name = str(uuid.uuid4())
         self.trainer.publish_iteration(
             self.project_id,
             iteration.id,
@@ -304,7 +601,42 @@ class Classifier:
             self.prediction_resource_id,
         )
         with api.app.app_context():
-            self.iteration_name = models.update_iteration_name(iteration_name)
+            models.update_iteration_name(iteration_name)
+
+        # use the new iteration immediately in this worker
+        self.set_iteration_name(iteration_name)
+
+    def wait_for_deletion(self, progress=None) -> None:
+        """
+            Polls the image counts of the project with exponential backoff
+            until all images are deleted, at most CV_DELETE_TIMEOUT seconds.
+        """
+
+        def is_deleted():
+            count = self.trainer.get_tagged_image_count(
+                self.project_id
+            ) + self.trainer.get_untagged_image_count(self.project_id)
+            if progress is not None:
+                progress(f"Waiting for {count} images to be deleted")
+
+            return count == 0
+
+        self.__poll(is_deleted, setup.CV_DELETE_TIMEOUT)
+
+    def __poll(self, is_done, timeout=None) -> None:
+        """
+            Calls is_done until it returns True, doubling the delay between
+            calls from CV_POLL_DELAY up to CV_POLL_MAX_DELAY seconds. Raises
+            TimeoutError if it takes more than timeout seconds.
+        """
+        delay = setup.CV_POLL_DELAY
+        start = time.monotonic()
+        while not is_done():
+            if timeout is not None and time.monotonic() - start > timeout:
+                raise TimeoutError(f"Not done after {timeout} seconds")
+
+            time.sleep(delay)
+            delay = min(delay * 2, setup.CV_POLL_MAX_DELAY)
 
     def delete_all_images(self) -> None:
         """
@@ -317,36 +649,36 @@ class Classifier:
         except Exception as e:
             raise Exception("Could not delete all images: " + str(e))
 
-    def retrain(self):
+        self.clear_manifests()
+
+    def retrain(self, progress=None):
         """
             Train model on all labels and update iteration.
         """
         with api.app.app_context():
             labels = models.get_all_labels()
 
-        self.upload_images(labels, setup.CONTAINER_NAME_NEW)
+        self.upload_images(labels, setup.CONTAINER_NAME_NEW, progress)
         try:
-            self.train(labels)
+            self.train(labels, progress)
         except CustomVisionErrorException as e:
             msg = "No changes since last training"
             print(e, "exiting...")
             raise excp.BadRequest(msg)
 
-    def hard_reset_retrain(self):
+    def hard_reset_retrain(self, progress=None):
         """
             Train model on all labels and update iteration.
-            This method sleeps for 60 seconds to make sure all
-            old images are deleted from custom vision before
-            uploading original dataset.
+            This method waits until all old images are deleted from custom
+            vision before uploading original dataset.
         """
         with api.app.app_context():
             labels = models.get_all_labels()
 
-        # Wait 60 seconds to make sure all images are deleted in custom vision
-        time.sleep(60)
-        self.upload_images(labels, setup.CONTAINER_NAME_ORIGINAL)
+        self.wait_for_deletion(progress)
+        self.upload_images(labels, setup.CONTAINER_NAME_ORIGINAL, progress)
         try:
-            self.train(labels)
+            self.train(labels, progress)
         except CustomVisionErrorException as e:
             msg = "No changes since last training"
             print(e, "exiting...")
@@ -0,0 +1,165 @@
+"""
+    Evaluates a published Custom Vision iteration on labelled images and
+    writes a confusion matrix and the accuracy per label as csv files.
+    Images are read either from a blob container, where each label is a
+    folder, or from a local directory with one subdirectory per label.
+
+    Example, run from src/:
+    python -m customvision.evaluate --container oldimgcontainer -n 50
+"""
+import os
+import csv
+import argparse
+from collections import defaultdict
+from webapp import api
+from webapp import models
+from utilities.blobstore import get_blobstore
+
+parser = argparse.ArgumentParser(
+    description="evaluate a Custom Vision iteration on labelled images"
+)
+source = parser.add_mutually_exclusive_group(required=True)
+source.add_argument(
+    "--container", type=str, help="blob container with a folder per label"
+)
+source.add_argument(
+    "--directory", type=str, help="local directory with a folder per label"
+)
+parser.add_argument(
+    "--labels",
+    type=str,
+    nargs="+",
+    default=None,
+    help="labels to evaluate, defaults to all labels",
+)
+parser.add_argument(
+    "-n", type=int, default=50, help="how many images of each label"
+)
+parser.add_argument(
+    "--iteration",
+    type=str,
+    default=None,
+    help="published iteration name, defaults to the current iteration",
+)
+parser.add_argument(
+    "--output", type=str, default="./evaluation", help="output directory"
+)
+
+
+def container_images(container_name, labels, n):
+    """
+        Yields (image URL, label) for at most n blobs per label.
+    """
+    blobstore = get_blobstore()
+    for label in labels:
+        names = blobstore.list_names(container_name, f"{label}/")
+        for i, name in zip(range(n), names):
+            yield blobstore.url(container_name, name), label
+
+
+def directory_images(directory, labels, n):
+    """
+        Yields (file path, label) for at most n .png files per label.
+    """
+    for label in labels:
+        label_dir = os.path.join(directory, label)
+        if not os.path.isdir(label_dir):
+            continue
+
+        files = sorted(f for f in os.listdir(label_dir) if f.endswith(".png"))
+        for file_name in files[:n]:
+            yield os.path.join(label_dir, file_name), label
+
+
+def evaluate(classifier, images, iteration_name=None):
+    """
+        Predicts all (image, label) pairs with Classifier.predict_batch.
+
+        Returns:
+        confusion (dict[str, dict[str, int]]): counts of predicted labels
+        per true label
+        failed (int): number of images that could not be predicted
+    """
+    # the labels of every image, an image may be listed more than once
+    true_labels = defaultdict(list)
+
+    def image_stream():
+        for image, label in images:
+            true_labels[image].append(label)
+            yield image
+
+    confusion = defaultdict(lambda: defaultdict(int))
+    failed = 0
+    results = classifier.predict_batch(image_stream(), iteration_name)
+    for i, (image, prediction, best_guess) in enumerate(results, 1):
+        # predictions of the same image are equal, so any of its labels
+        # gives the same counts
+        label = true_labels[image].pop()
+        if not true_labels[image]:
+            del true_labels[image]
+        if best_guess is None:
+            failed += 1
+        else:
+            confusion[label][best_guess] += 1
+
+        print(f"\t evaluated {i:5d} images", end="\r", flush=True)
+
+    print()
+    return confusion, failed
+
+
+def write_results(confusion, output):
+    """
+        Writes confusion_matrix.csv and accuracy.csv to the output directory.
+        Returns the overall accuracy.
+    """
+    os.makedirs(output, exist_ok=True)
+    labels = sorted(
+        set(confusion).union(*[set(row) for row in confusion.values()])
+    )
+    with open(os.path.join(output, "confusion_matrix.csv"), "w") as f:
+        writer = csv.writer(f)
+        writer.writerow(["label \\ prediction"] + labels)
+        for label in labels:
+            row = confusion.get(label, {})
+            writer.writerow([label] + [row.get(guess, 0) for guess in labels])
+
+    correct = 0
+    total = 0
+    with open(os.path.join(output, "accuracy.csv"), "w") as f:
+        writer = csv.writer(f)
+        writer.writerow(["label", "images", "correct", "accuracy"])
+        for label in sorted(confusion):
+            row = confusion[label]
+            images = sum(row.values())
+            hits = row.get(label, 0)
+            writer.writerow([label, images, hits, f"{hits / images:.4f}"])
+            correct += hits
+            total += images
+
+    return correct / total if total else 0.0
+
+
+def main():
+    """
+        Main function of the script.
+    """
+    args = parser.parse_args()
+    labels = args.labels
+    if labels is None:
+        with api.app.app_context():
+            labels = models.get_all_labels()
+
+    if args.container:
+        images = container_images(args.container, labels, args.n)
+    else:
+        images = directory_images(args.directory, labels, args.n)
+
+    confusion, failed = evaluate(api.get_classifier(), images, args.iteration)
+    accuracy = write_results(confusion, args.output)
+    print(f"Accuracy: {accuracy:.2%}, failed predictions: {failed}")
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
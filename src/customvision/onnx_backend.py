@@ -0,0 +1,98 @@
+"""
+    Local prediction backend running a compact model exported from Azure
+    Custom Vision with onnxruntime on the CPU. Requires the optional packages
+    numpy and onnxruntime.
+"""
+from io import BytesIO
+from typing import Dict
+from urllib.request import urlopen
+from PIL import Image
+from customvision.backend import PredictionBackend
+from utilities import setup
+
+try:
+    import numpy as np
+    import onnxruntime
+except ImportError:
+    onnxruntime = None
+
+# Input size used when the model does not specify a fixed one
+DEFAULT_INPUT_SIZE = 224
+
+
+class OnnxBackend(PredictionBackend):
+    """
+        Predicts images with an exported Custom Vision model. The export
+        consists of model.onnx and labels.txt, with one label per line in the
+        order of the model output.
+    """
+
+    def __init__(self, model_path: str, labels_path: str) -> None:
+        if onnxruntime is None:
+            raise ImportError(
+                "numpy and onnxruntime must be installed to use the onnx "
+                "prediction backend"
+            )
+
+        self.session = onnxruntime.InferenceSession(
+            model_path, providers=["CPUExecutionProvider"]
+        )
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        # input is NCHW, dimensions may be symbolic
+        height, width = model_input.shape[2:4]
+        self.height = height if isinstance(height, int) else DEFAULT_INPUT_SIZE
+        self.width = width if isinstance(width, int) else DEFAULT_INPUT_SIZE
+
+        with open(labels_path) as labels_file:
+            self.labels = [
+                line.strip() for line in labels_file if line.strip()
+            ]
+
+    def predict_image(self, img, iteration_name: str) -> Dict[str, float]:
+        """
+            Predicts the image read from the file handle img. The iteration
+            name is ignored, the exported model is always used.
+        """
+        image = Image.open(img).convert("RGB")
+        image = image.resize((self.width, self.height), Image.BILINEAR)
+        # Custom Vision models expect BGR pixel values in [0, 255] as NCHW
+        data = np.asarray(image, dtype=np.float32)[:, :, ::-1]
+        data = np.ascontiguousarray(data.transpose(2, 0, 1)[np.newaxis])
+        outputs = self.session.run(None, {self.input_name: data})
+        return self.__probabilities(outputs)
+
+    def predict_image_url(
+        self, img_url: str, iteration_name: str
+    ) -> Dict[str, float]:
+        """
+            Downloads the image and predicts it locally.
+        """
+        with urlopen(img_url, timeout=setup.IMAGE_DOWNLOAD_TIMEOUT) as res:
+            return self.predict_image(BytesIO(res.read()), iteration_name)
+
+    def __probabilities(self, outputs) -> Dict[str, float]:
+        """
+            Converts the model outputs into a label to probability dictionary.
+            Older exports return a list of dictionaries, newer exports return
+            a tensor ordered as labels.txt.
+        """
+        for output in outputs:
+            if isinstance(output, list) and output and isinstance(
+                output[0], dict
+            ):
+                return dict(
+                    [(str(k), float(v)) for k, v in output[0].items()]
+                )
+
+        for output in outputs:
+            if isinstance(output, np.ndarray) and output.dtype.kind == "f":
+                scores = output.reshape(-1)
+                return dict(
+                    [
+                        (label, float(score))
+                        for label, score in zip(self.labels, scores)
+                    ]
+                )
+
+        raise ValueError("Could not read probabilities from model output")
@@ -6,14 +6,19 @@
 
 import numpy as np
 import cairocffi as cairo
-import json
 import os
 import argparse
-from azure.storage.blob import BlobServiceClient
-from utilities.keys import Keys
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import as_completed
+from azure.core.exceptions import ResourceExistsError
+from preprocessing.ndjson_reader import NdjsonReader
+from utilities.blobstore import get_blobstore
 from utilities import setup
 
-CONNECT_STR = Keys.get("BLOB_CONNECTION_STRING")
+# Number of drawings rasterized per task in a worker process
+SHARD_SIZE = 256
+
 parser = argparse.ArgumentParser(
     description="convert .ndjson into .png and upload to azure blobstore"
 )
@@ -27,21 +32,73 @@ parser.add_argument(
 parser.add_argument(
     "-n", type=int, default=50, help="how many images of each class"
 )
+parser.add_argument(
+    "--sample",
+    action="store_true",
+    help="pick random drawings instead of the first n",
+)
+parser.add_argument(
+    "--seed", type=int, default=None, help="random seed used by --sample"
+)
+parser.add_argument(
+    "--recognized",
+    action="store_true",
+    help="only drawings recognized by the Quick Draw model",
+)
+parser.add_argument(
+    "--skip-existing",
+    action="store_true",
+    help="skip drawings already uploaded to blob storage",
+)
+parser.add_argument(
+    "--side", type=int, default=256, help="size of the images in pixels"
+)
+parser.add_argument(
+    "--processes",
+    type=int,
+    default=os.cpu_count(),
+    help="processes drawing images",
+)
+parser.add_argument(
+    "--threads",
+    type=int,
+    default=setup.HTTP_POOL_SIZE,
+    help="threads uploading images",
+)
+
+
+def centering_offsets(vector_images, original_side=256.0):
+    """
+        Returns an array with the (x, y) offset centering each drawing on the
+        original canvas. The bounding boxes of all drawings are computed in
+        one pass over their concatenated points.
+    """
+    strokes = [stroke for image in vector_images for stroke in image]
+    lengths = [len(stroke[0]) for stroke in strokes]
+    points = np.concatenate(
+        [np.asarray(stroke, dtype=np.float64) for stroke in strokes], axis=1
+    )
+
+    # index of the first point of each drawing in the concatenated points
+    stroke_counts = [len(image) for image in vector_images]
+    stroke_starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    drawing_starts = stroke_starts[
+        np.concatenate(([0], np.cumsum(stroke_counts)[:-1]))
+    ]
+    bbox = np.maximum.reduceat(points, drawing_starts, axis=1).T
+    return (original_side - bbox) / 2.0
 
 
 def vector_to_raster(
     vector_images,
-    blob_service_client,
     side=28,
     line_diameter=16,
     padding=16,
     bg_color=(1, 1, 1),
-    className="boat",
     fg_color=(0, 0, 0),
-    dirp="",
-    keys=[],
 ):
     """
+        Draws the drawings and returns them as a list of png encoded bytes.
         padding and line_diameter are relative to the original 256x256 image.
     """
 
@@ -61,67 +118,138 @@ def vector_to_raster(
     ctx.scale(new_scale, new_scale)
     ctx.translate(total_padding / 2.0, total_padding / 2.0)
 
-    raster_images = []
-    for vector_image, key in zip(vector_images, keys):
+    offsets = centering_offsets(vector_images, original_side)
+    png_images = []
+    for vector_image, (dx, dy) in zip(vector_images, offsets):
         # clear background
         ctx.set_source_rgb(*bg_color)
         ctx.paint()
-        intermediate = np.hstack(vector_image)
-        bbox = intermediate.max(axis=1)
-        offset = ((original_side, original_side) - bbox) / 2.0
-        offset = offset.reshape(-1, 1)
-        centered = [stroke + offset for stroke in vector_image]
 
         # draw strokes, this is the most cpu-intensive part
         ctx.set_source_rgb(*fg_color)
-        for xv, yv in centered:
-            ctx.move_to(xv[0], yv[0])
+        for xv, yv in vector_image:
+            ctx.move_to(xv[0] + dx, yv[0] + dy)
             for x, y in zip(xv, yv):
-                ctx.line_to(x, y)
+                ctx.line_to(x + dx, y + dy)
             ctx.stroke()
 
-        filepath = f"{dirp}/{key}.png"
-        surface.write_to_png(filepath)
-        upload_to_blob(filepath, key, className, blob_service_client)
-        data = surface.get_data()
-        raster_image = np.copy(np.asarray(data)[::4])
-        raster_images.append(raster_image)
+        # encode the png in memory instead of writing it to disk
+        png_images.append(surface.write_to_png())
+
+    return png_images
 
-    return raster_images
+
+def rasterize_shard(class_name, keys, vector_images, side):
+    """
+        Draws a shard of drawings from one class in a worker process.
+        Returns a list of (blob name, png bytes).
+    """
+    png_images = vector_to_raster(vector_images, side=side)
+    return [
+        (f"{class_name}/{key}.png", png)
+        for key, png in zip(keys, png_images)
+    ]
 
 
-def upload_to_blob(path, key, class_name, blob_service_client):
+def upload_to_blob(blob_name, data, blobstore):
     """
         Upload files to Blob Storage.
     """
-    blob_name = f"{class_name}/{key}.png"
     print(blob_name)
-    blob_client = blob_service_client.get_blob_client(
-        setup.CONTAINER_NAME_ORIGINAL, blob=blob_name
-    )
-    with open(path, "rb") as localFile:
-        try:
-            blob_client.upload_blob(localFile)
-        except Exception as e:
-            pass
-            print(f"the image {key} already exists {e}")
+    try:
+        blobstore.upload(
+            setup.CONTAINER_NAME_ORIGINAL, blob_name, data, overwrite=False
+        )
+    except ResourceExistsError as e:
+        print(f"the image {blob_name} already exists {e}")
+
+
+def convert(
+    class_names,
+    n,
+    side,
+    processes,
+    threads,
+    sample=False,
+    recognized=False,
+    skip_existing=False,
+    seed=None,
+):
+    """
+        Converts n drawings of each class to png images and uploads them.
+        See get_images_from_class for sample and recognized. With
+        skip_existing, drawings already in blob storage are not picked.
+        Drawings are split into shards of SHARD_SIZE and drawn in a pool of
+        processes. The images are uploaded by a pool of threads as soon as
+        their shard is done, while other shards are still being drawn.
+    """
+    blobstore = get_blobstore()
+    try:
+        blobstore.create_container(setup.CONTAINER_NAME_ORIGINAL)
+    except ResourceExistsError:
+        pass
+
+    with ProcessPoolExecutor(max_workers=processes) as rasterizers:
+        shards = []
+        for class_name in class_names:
+            skip_keys = set()
+            if skip_existing:
+                skip_keys = get_existing_keys(class_name, blobstore)
 
+            vectors = get_images_from_class(
+                class_name, n, sample, recognized, skip_keys, seed
+            )
+            for i in range(0, len(vectors), SHARD_SIZE):
+                shard = vectors[i : i + SHARD_SIZE]
+                shards.append(
+                    rasterizers.submit(
+                        rasterize_shard,
+                        class_name,
+                        [v["key_id"] for v in shard],
+                        [v["drawing"] for v in shard],
+                        side,
+                    )
+                )
 
-def get_images_from_class(className, N=100):
+        with ThreadPoolExecutor(max_workers=threads) as uploaders:
+            uploads = []
+            for shard in as_completed(shards):
+                for blob_name, data in shard.result():
+                    uploads.append(
+                        uploaders.submit(
+                            upload_to_blob, blob_name, data, blobstore
+                        )
+                    )
+
+            for upload in uploads:
+                upload.result()
+
+
+def get_images_from_class(
+    className, N=100, sample=False, recognized=False, skip_keys=(), seed=None
+):
     """
-        Retrieve images from the class provided.
+        Retrieve images from the class provided. Takes the first N drawings,
+        or N random drawings if sample is True. Drawings not recognized by
+        the Quick Draw model and drawings with keys in skip_keys can be left
+        out.
     """
     path = f"./preprocessing/data/{className}.ndjson"
-    lines = []
-    with open(path) as f:
-        while len(lines) < N:
-            try:
-                line = json.loads(next(f))
-            except StopIteration:
-                break
-            lines.append(line)
+    reader = NdjsonReader(path)
+    if sample:
+        return reader.sample(N, recognized, skip_keys, seed)
 
-    return lines
+    return reader.head(N, recognized, skip_keys)
+
+
+def get_existing_keys(className, blobstore):
+    """
+        Returns the keys of the drawings of the class already in blob
+        storage.
+    """
+    prefix = f"{className}/"
+    names = blobstore.list_names(setup.CONTAINER_NAME_ORIGINAL, prefix)
+    return set(name[len(prefix) : -len(".png")] for name in names)
 
 
 def get_classnames():
@@ -142,37 +270,21 @@ def main():
     """
     args = parser.parse_args()
     cnames = args.classNames
-    imgpath = "./preprocessing/images"
-    blob_service_client = BlobServiceClient.from_connection_string(CONNECT_STR)
-
-    if not os.path.exists(imgpath):
-        os.makedirs(imgpath)
 
     if cnames[0] == "all":
         cnames = get_classnames()
 
-    for className in cnames:
-        dirp = f"{imgpath}/{className}"
-        container_name = setup.CONTAINER_NAME_ORIGINAL
-        if container_name not in [
-            c["name"] for c in blob_service_client.list_containers()
-        ]:
-            blob_service_client.create_container(container_name)
-
-        if not os.path.exists(dirp):
-            os.makedirs(dirp)
-
-        vectors = get_images_from_class(className, N=args.n)
-        paths = [v["drawing"] for v in vectors]
-        keys = [v["key_id"] for v in vectors]
-        vector_to_raster(
-            paths,
-            blob_service_client,
-            side=256,
-            dirp=dirp,
-            keys=keys,
-            className=className,
-        )
+    convert(
+        cnames,
+        args.n,
+        args.side,
+        args.processes,
+        args.threads,
+        args.sample,
+        args.recognized,
+        args.skip_existing,
+        args.seed,
+    )
 
 
 if __name__ == "__main__":
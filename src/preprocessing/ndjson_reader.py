@@ -0,0 +1,210 @@
+"""
+    Random access reader for the Quick Draw .ndjson files. The file is
+    memory-mapped and the byte offset of every line is stored in an index
+    next to it, so drawings can be sampled at random without parsing the
+    whole file.
+"""
+import os
+import mmap
+import json
+import random
+import numpy as np
+
+# Suffix of the offset index stored next to each .ndjson file
+INDEX_SUFFIX = ".index.npz"
+# Bytes scanned at a time when the index is built
+SCAN_CHUNK_SIZE = 64 * 1024 * 1024
+
+
+class NdjsonReader:
+    """
+        Reads drawings from an .ndjson file. The offset index is built on
+        first use and reused until the size or modification time of the file
+        changes. Without an index, drawings are sampled with a single
+        streaming pass using reservoir sampling.
+    """
+
+    def __init__(self, path, use_index=True):
+        self.path = path
+        self.use_index = use_index
+        self.__offsets = None
+
+    def offsets(self):
+        """
+            Returns an array with the byte offset of the start of every line,
+            followed by the size of the file.
+        """
+        if self.__offsets is None:
+            self.__offsets = self.__load_index()
+            if self.__offsets is None:
+                self.__offsets = self.__build_index()
+                self.__save_index(self.__offsets)
+
+        return self.__offsets
+
+    def __len__(self):
+        return len(self.offsets()) - 1
+
+    def head(self, n, recognized=False, skip_keys=()):
+        """
+            Returns the first n drawings passing the filters, reading the
+            file from the top.
+        """
+        return list(self.__filtered(self.__lines(), n, recognized, skip_keys))
+
+    def sample(self, n, recognized=False, skip_keys=(), seed=None):
+        """
+            Returns n drawings picked at random among the drawings passing
+            the filters. Drawings that are recognized=False or whose key_id
+            is in skip_keys are left out if requested.
+        """
+        rng = random.Random(seed)
+        if not self.use_index:
+            drawings = self.__filtered(
+                self.__lines(), None, recognized, skip_keys
+            )
+            return reservoir_sample(drawings, n, rng)
+
+        offsets = self.offsets()
+        if len(offsets) < 2:
+            return []
+
+        with open(self.path, "rb") as f, self.__map(f) as mm:
+            lines = (
+                mm[offsets[i] : offsets[i + 1]]
+                for i in self.__permutation(len(offsets) - 1, rng)
+            )
+            return list(self.__filtered(lines, n, recognized, skip_keys))
+
+    def __permutation(self, size, rng):
+        """
+            Yields the numbers below size in random order, without creating
+            the whole permutation when only a few are needed.
+        """
+        seen = set()
+        while len(seen) < size // 2:
+            i = rng.randrange(size)
+            if i not in seen:
+                seen.add(i)
+                yield i
+
+        rest = [i for i in range(size) if i not in seen]
+        rng.shuffle(rest)
+        yield from rest
+
+    def __filtered(self, lines, n, recognized, skip_keys):
+        """
+            Parses the lines and yields at most n drawings passing the
+            filters.
+        """
+        count = 0
+        for line in lines:
+            if n is not None and count >= n:
+                return
+
+            if not line.strip():
+                continue
+
+            drawing = json.loads(line)
+            if recognized and not drawing.get("recognized", True):
+                continue
+
+            if drawing["key_id"] in skip_keys:
+                continue
+
+            count += 1
+            yield drawing
+
+    def __lines(self):
+        """
+            Yields the lines of the file.
+        """
+        with open(self.path, "rb") as f:
+            yield from f
+
+    def __map(self, f):
+        """
+            Memory-maps the open file for reading.
+        """
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __index_path(self):
+        return self.path + INDEX_SUFFIX
+
+    def __file_stamp(self):
+        """
+            Returns the size and modification time identifying the version
+            of the file the index belongs to.
+        """
+        stat = os.stat(self.path)
+        return np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+
+    def __load_index(self):
+        """
+            Returns the stored offsets, or None if there is no index for the
+            current version of the file.
+        """
+        try:
+            with np.load(self.__index_path()) as index:
+                if np.array_equal(index["stamp"], self.__file_stamp()):
+                    return index["offsets"]
+        except (OSError, KeyError, ValueError):
+            pass
+
+        return None
+
+    def __save_index(self, offsets):
+        """
+            Stores the offsets next to the file. The index is only a cache,
+            so failing to write it is not an error.
+        """
+        try:
+            np.savez(
+                self.__index_path(), offsets=offsets, stamp=self.__file_stamp()
+            )
+        except OSError:
+            pass
+
+    def __build_index(self):
+        """
+            Finds the start of every line by scanning the memory-mapped file
+            for newlines in chunks.
+        """
+        size = os.path.getsize(self.path)
+        if size == 0:
+            return np.zeros(1, dtype=np.int64)
+
+        starts = [np.zeros(1, dtype=np.int64)]
+        with open(self.path, "rb") as f, self.__map(f) as mm:
+            for start in range(0, size, SCAN_CHUNK_SIZE):
+                chunk = np.frombuffer(
+                    mm, dtype=np.uint8,
+                    count=min(SCAN_CHUNK_SIZE, size - start), offset=start,
+                )
+                newlines = np.flatnonzero(chunk == ord("\n"))
+                starts.append(newlines.astype(np.int64) + start + 1)
+                del chunk
+
+        offsets = np.concatenate(starts)
+        # the last line may or may not end with a newline
+        if offsets[-1] != size:
+            offsets = np.append(offsets, size)
+
+        return offsets
+
+
+def reservoir_sample(items, n, rng=random):
+    """
+        Returns n items picked uniformly at random from an iterable of
+        unknown length, in a single pass.
+    """
+    reservoir = []
+    for i, item in enumerate(items):
+        if i < n:
+            reservoir.append(item)
+        else:
+            j = rng.randrange(i + 1)
+            if j < n:
+                reservoir[j] = item
+
+    return reservoir
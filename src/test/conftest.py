@@ -0,0 +1,28 @@
+"""
+    Fixtures shared by the tests. Tests using the database request the
+    database fixture, so unit tests run without database or Azure access.
+"""
+import pytest
+
+
+@pytest.fixture(scope="session")
+def database():
+    """
+        Creates the tables and seeds the labels once per test session, like
+        webapp.init does before the workers are started.
+    """
+    # imported here, as importing the app needs the keys
+    from webapp import init
+
+    init.init(sync_iteration=False)
+
+
+@pytest.fixture(scope="session")
+def iteration(database):
+    """
+        Returns the iteration name, stored in the database from Custom
+        Vision on first use if it is missing.
+    """
+    from customvision.classifier import Classifier
+
+    return Classifier().get_iteration_name()
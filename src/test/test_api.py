@@ -16,6 +16,10 @@ from werkzeug import exceptions as excp
 from PIL import Image
 
 
+# every test in this module uses the test database
+pytestmark = pytest.mark.usefixtures("database")
+
+
 @pytest.fixture
 def client():
     """
@@ -225,6 +229,55 @@ def test_allowedFile_correct():
     allowed_file_helper(cfg.API_IMAGE4, True, "image/png")
 
 
+def test_allowedFile_returns_image_bytes():
+    """
+        Test that allowedFile returns the bytes of the uploaded image, so the
+        upload only has to be read once.
+    """
+    path = os.path.join(construct_path(cfg.API_PATH_DATA), cfg.API_IMAGE4)
+    with open(path, "rb") as f:
+        expected = f.read()
+
+    data = allowed_file_helper(cfg.API_IMAGE4, True, "image/png")
+    assert data == expected
+
+
+def test_get_image_resolution_reads_png_header():
+    """
+        Test that the resolution read from the png header matches the
+        resolution found by decoding the image.
+    """
+    path = os.path.join(construct_path(cfg.API_PATH_DATA), cfg.API_IMAGE4)
+    with open(path, "rb") as f:
+        data = f.read()
+
+    assert api.get_image_resolution(data) == Image.open(io.BytesIO(data)).size
+
+
+def test_get_image_resolution_truncated_header():
+    """
+        Test that a png cut off inside the header is rejected as the wrong
+        format.
+    """
+    data = api.PNG_SIGNATURE + b"\x00\x00\x00\x0dIHDR\x00\x00"
+    with raises(excp.UnsupportedMediaType):
+        api.get_image_resolution(data)
+
+
+def test_classify_request_too_large(client):
+    """
+        Test that a request larger than MAX_REQUEST_SIZE is rejected before
+        the image is read.
+    """
+    data = {
+        "image": (io.BytesIO(b"0" * (setup.MAX_REQUEST_SIZE + 1)), "a.png"),
+        "player_id": "",
+        "time": "0",
+    }
+    res = client.post("/classify", data=data)
+    assert res.status_code == 413
+
+
 def allowed_file_helper(filename, expected_result, content_type):
     """
         Helper function for the allowedFile function tests.
@@ -308,6 +361,33 @@ def test_view_highscore(client):
         assert(isinstance(response["total"][0], dict))
 
 
+def test_view_highscore_not_modified(client):
+    """
+        Test that the high score list returns 304 Not Modified when the ETag
+        from the previous response is sent in If-None-Match.
+    """
+    res = client.get("/viewHighScore")
+    etag = res.headers["ETag"]
+    res = client.get("/viewHighScore", headers={"If-None-Match": etag})
+    assert res.status_code == 304
+    assert res.data == b""
+
+
+def test_high_score_stream_first_event(client):
+    """
+        Test that the high score stream starts with an event containing both
+        high score lists.
+    """
+    res = client.get("/highScoreStream", buffered=False)
+    assert res.mimetype == "text/event-stream"
+    event = next(res.response).decode("utf-8")
+    res.close()
+    assert event.startswith("event: highscore\ndata: ")
+    data = json.loads(event.split("data: ", 1)[1])
+    assert "daily" in data
+    assert "total" in data
+
+
 def test_white_image_true():
     """
         Test if the white_image function returns True if the image is
@@ -332,6 +412,26 @@ def test_white_image_false():
     assert(white is False)
 
 
+def test_white_image_nearly_blank():
+    """
+        Test if the white_image function ignores a single stray pixel and
+        light antialiasing noise.
+    """
+    img = Image.new("RGB", (256, 256), (255, 255, 255))
+    img.putpixel((128, 128), (0, 0, 0))
+    img.putpixel((10, 10), (230, 230, 230))
+    assert(api.white_image(img) is True)
+
+
+def test_white_image_transparent():
+    """
+        Test if the white_image function treats a transparent canvas as
+        blank.
+    """
+    img = Image.new("RGBA", (256, 256), (0, 0, 0, 0))
+    assert(api.white_image(img) is True)
+
+
 def test_white_image_data_keys():
     """
         Test if the white_image_data_function returns a data of the correct
@@ -0,0 +1,80 @@
+"""
+    Tests for the local blob storage backend.
+"""
+import pytest
+from azure.core.exceptions import ResourceExistsError
+from utilities.blobstore import sync
+from utilities.local_blobstore import LocalBlobStore
+
+
+@pytest.fixture
+def blobstore(tmp_path):
+    """
+        Local blob store in a temporary directory.
+    """
+    yield LocalBlobStore(str(tmp_path))
+
+
+def test_upload_and_list(blobstore):
+    """
+        Test that uploaded blobs are listed by prefix with the label/key
+        layout and can be downloaded.
+    """
+    blobstore.upload("container", "cat/1.png", b"cat")
+    blobstore.upload("container", "dog/2.png", b"dog")
+    assert list(blobstore.list_names("container")) == ["cat/1.png", "dog/2.png"]
+    assert list(blobstore.list_names("container", "dog/")) == ["dog/2.png"]
+    assert blobstore.download("container", "cat/1.png") == b"cat"
+
+
+def test_upload_without_overwrite(blobstore):
+    """
+        Test that uploading an existing blob without overwrite fails and
+        keeps the old content.
+    """
+    blobstore.upload("container", "cat/1.png", b"old")
+    with pytest.raises(ResourceExistsError):
+        blobstore.upload("container", "cat/1.png", b"new", overwrite=False)
+    assert blobstore.download("container", "cat/1.png") == b"old"
+
+
+def test_upload_without_hard_links(blobstore, monkeypatch):
+    """
+        Test that uploads without overwrite work on filesystems without hard
+        links, and still refuse existing blobs.
+    """
+
+    def link(source, target):
+        raise PermissionError("Operation not permitted")
+
+    monkeypatch.setattr("os.link", link)
+    blobstore.upload("container", "cat/1.png", b"old", overwrite=False)
+    with pytest.raises(ResourceExistsError):
+        blobstore.upload("container", "cat/1.png", b"new", overwrite=False)
+    assert blobstore.download("container", "cat/1.png") == b"old"
+    assert list(blobstore.list_names("container")) == ["cat/1.png"]
+
+
+def test_container_metadata(blobstore):
+    """
+        Test that container metadata is stored in the sidecar file and
+        removed with the container.
+    """
+    blobstore.create_container("container", {"image_count": "0"})
+    assert blobstore.get_metadata("container") == {"image_count": "0"}
+    blobstore.delete_container("container")
+    assert blobstore.get_metadata("container") == {}
+    assert list(blobstore.list_names("container")) == []
+
+
+def test_sync_copies_missing_blobs(tmp_path):
+    """
+        Test that sync only copies the blobs missing in the target.
+    """
+    source = LocalBlobStore(str(tmp_path / "source"))
+    target = LocalBlobStore(str(tmp_path / "target"))
+    source.upload("container", "cat/1.png", b"1")
+    source.upload("container", "cat/2.png", b"2")
+    target.upload("container", "cat/1.png", b"1")
+    assert sync(source, target, "container") == 1
+    assert target.download("container", "cat/2.png") == b"2"
@@ -0,0 +1,22 @@
+"""
+    Tests for the shared Azure client registry.
+"""
+from utilities import clients
+
+
+def test_client_created_once():
+    """
+        Test that the registry returns the same client on every call.
+    """
+    assert clients.blob_service_client() is clients.blob_service_client()
+    assert clients.prediction_client() is clients.prediction_client()
+
+
+def test_reset_forgets_clients():
+    """
+        Test that clients are created again after the registry is reset, as
+        happens in forked processes.
+    """
+    client = clients.training_client()
+    clients.reset()
+    assert clients.training_client() is not client
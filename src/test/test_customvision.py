@@ -1,12 +1,21 @@
 import pytest
 import os
+import json
+from types import SimpleNamespace
+from urllib.parse import quote
+from PIL import Image
+from PIL import ImageDraw
 from customvision.classifier import Classifier
+from customvision import backend
+from customvision.cache import image_hash
+from customvision import evaluate
 from test.test_api import construct_path
 from test import config as cfg
+from utilities import setup
 
 
 @pytest.fixture
-def classifier():
+def classifier(database):
     """
         initialize custom vision classifer object.
     """
@@ -50,3 +59,163 @@ def test_probabilities_format(classifier):
         for k, v in probabilities.items():
             assert type(k) is str
             assert type(v) is float
+
+
+def test_get_backend_unknown_name():
+    """
+        Test that an unknown prediction backend name raises an exception.
+    """
+    with pytest.raises(ValueError):
+        backend.get_backend("unknown", None, "project_id")
+
+
+def test_iteration_name_cached(classifier):
+    """
+        Test that the iteration name is served from the classifier cache.
+    """
+    classifier.set_iteration_name("cached_iteration")
+    assert classifier.get_iteration_name() == "cached_iteration"
+
+
+def test_repeated_prediction_is_cached(classifier):
+    """
+        Test that predicting the same image twice only calls the prediction
+        backend once and returns the same result.
+    """
+    path = construct_path(cfg.API_PATH_DATA)
+    path = os.path.join(path, cfg.CV_TEST_IMAGE)
+    with open(path, "rb") as fh:
+        first = classifier.predict_image(fh)
+        second = classifier.predict_image(fh)
+
+    assert first == second
+    assert classifier.prediction_cache.hits == 1
+
+
+def test_predict_batch_yields_every_image(classifier):
+    """
+        Test that predict_batch returns one result per image.
+    """
+    path = construct_path(cfg.API_PATH_DATA)
+    path = os.path.join(path, cfg.CV_TEST_IMAGE)
+    results = list(classifier.predict_batch([path, path, path], workers=2))
+    assert len(results) == 3
+    for image, probabilities, best_guess in results:
+        assert image == path
+        assert type(best_guess) is str
+
+
+def test_clear_manifests(classifier, tmp_path, monkeypatch):
+    """
+        Test that clearing the upload manifests removes them, so the next
+        upload sends every image again.
+    """
+    monkeypatch.setattr(setup, "UPLOAD_MANIFEST_DIR", str(tmp_path))
+    manifest = tmp_path / "container.json"
+    manifest.write_text('["cat/1.png"]')
+    classifier.clear_manifests()
+    assert not manifest.exists()
+
+
+def test_upload_images_encoded_source_url(classifier, tmp_path, monkeypatch):
+    """
+        Test that uploaded images are recorded in the manifest when Custom
+        Vision returns their URLs encoded, and that unknown URLs are skipped.
+    """
+    monkeypatch.setattr(setup, "UPLOAD_MANIFEST_DIR", str(tmp_path))
+    names = ["birthday cake/1.png", "birthday cake/2.png"]
+
+    def create_images_from_urls(project_id, images):
+        results = [
+            SimpleNamespace(
+                source_url=quote(entry.url, safe=":/"), status="OK"
+            )
+            for entry in images
+        ]
+        results.append(SimpleNamespace(source_url="unknown", status="OK"))
+        return SimpleNamespace(images=results)
+
+    classifier.trainer = SimpleNamespace(
+        get_tags=lambda project_id: [
+            SimpleNamespace(name="birthday cake", id="tag")
+        ],
+        create_images_from_urls=create_images_from_urls,
+    )
+    blobs = [SimpleNamespace(name=name) for name in names]
+    container = SimpleNamespace(list_blobs=lambda name_starts_with: blobs)
+    classifier.blob_service_client = SimpleNamespace(
+        get_container_client=lambda name: container
+    )
+    classifier.upload_images(["birthday cake"], "container")
+    manifest = json.loads((tmp_path / "container.json").read_text())
+    assert manifest == names
+
+
+def stroke_image(box):
+    """
+        Returns a white 300x300 drawing with a black rectangle in box.
+    """
+    image = Image.new("L", (300, 300), 255)
+    ImageDraw.Draw(image).rectangle(box, fill=0)
+    return image
+
+
+def test_image_hash_distinct_drawings():
+    """
+        Test that drawings with horizontal strokes, strokes at other
+        positions and thicker strokes don't share the hash of each other or
+        of a blank canvas.
+    """
+    drawings = [
+        Image.new("L", (300, 300), 255),
+        stroke_image((0, 140, 299, 150)),
+        stroke_image((0, 40, 299, 50)),
+        stroke_image((0, 120, 299, 170)),
+        stroke_image((140, 0, 150, 299)),
+    ]
+    hashes = [
+        image_hash(drawing, setup.PREDICTION_HASH_SIZE)
+        for drawing in drawings
+    ]
+    assert len(set(hashes)) == len(drawings)
+
+
+def test_image_hash_ignores_small_differences():
+    """
+        Test that a drawing with a few stray pixels has the same hash.
+    """
+    drawing = stroke_image((0, 140, 299, 150))
+    noisy = drawing.copy()
+    noisy.putpixel((10, 10), 200)
+    noisy.putpixel((250, 30), 200)
+    assert image_hash(drawing, setup.PREDICTION_HASH_SIZE) == image_hash(
+        noisy, setup.PREDICTION_HASH_SIZE
+    )
+
+
+def test_evaluate_duplicate_images():
+    """
+        Test that an image listed more than once is counted every time.
+    """
+
+    class FakeClassifier:
+        def predict_batch(self, images, iteration_name):
+            for image in list(images)[::-1]:
+                yield image, {"cat": 1.0}, "cat"
+
+    images = [("a.png", "cat"), ("a.png", "cat"), ("b.png", "cow")]
+    confusion, failed = evaluate.evaluate(FakeClassifier(), images)
+    assert confusion == {"cat": {"cat": 2}, "cow": {"cat": 1}}
+    assert failed == 0
+
+
+def test_evaluation_accuracy(tmp_path):
+    """
+        Test that the evaluation writes the result files and computes the
+        overall accuracy from the confusion matrix.
+    """
+    confusion = {"cat": {"cat": 3, "cow": 1}, "cow": {"cow": 2, "cat": 2}}
+    accuracy = evaluate.write_results(confusion, str(tmp_path))
+    assert accuracy == 5 / 8
+    assert os.path.isfile(os.path.join(str(tmp_path), "accuracy.csv"))
+    assert os.path.isfile(os.path.join(str(tmp_path), "confusion_matrix.csv"))
@@ -3,16 +3,24 @@
     functions is used on an identical test database.
 """
 import os
+import json
 import uuid
 import time
 import datetime
+import pytest
+import sqlalchemy
 from webapp import api
 from webapp import models
+from webapp import janitor
 from pytest import raises
 from werkzeug import exceptions as excp
 from test import config as cfg
 
 
+# every test in this module uses the test database
+pytestmark = pytest.mark.usefixtures("database")
+
+
 class TestValues:
     PLAYER_ID = uuid.uuid4().hex
     GAME_ID = uuid.uuid4().hex
@@ -185,7 +193,7 @@ def test_get_top_n_high_score_list_structure():
         assert "name" in player
 
 
-def test_get_iteration_name_is_string():
+def test_get_iteration_name_is_string(iteration):
     """
         Tests if it's possible to get an iteration name from the database and the type is str
     """
@@ -235,7 +243,7 @@ def test_to_norwegian_illegal_parameter():
         models.to_norwegian("this word is not in the database")
 
 
-def test_get_iteration_name_length():
+def test_get_iteration_name_length(iteration):
     """
         Test if the result returned has specified length
     """
@@ -254,3 +262,300 @@ def test_high_score_cleared():
         num_records = models.Scores.query.count()
 
     assert num_records == 0
+
+
+def test_translation_dict_matches_labels_table():
+    """
+        Test that the cached translation dictionary matches the Labels table.
+    """
+    with api.app.app_context():
+        translation = models.get_translation_dict()
+        labels = models.Labels.query.all()
+
+    assert translation == dict(
+        [(str(label.english), str(label.norwegian)) for label in labels]
+    )
+
+
+def test_invalidate_labels_bumps_version():
+    """
+        Test that invalidating the label cache increases the version and that
+        the labels are reloaded on next use.
+    """
+    with api.app.app_context():
+        models.get_all_labels()
+        version = models.label_cache.version
+        new_version = models.invalidate_labels()
+        labels = models.get_all_labels()
+
+    assert new_version == version + 1
+    assert models.label_cache.version == new_version
+    assert len(labels) > 0
+
+
+def test_label_change_reaches_other_workers():
+    """
+        Test that a label inserted through one worker's cache is seen by the
+        cache of another worker once its ttl has expired.
+    """
+    english = uuid.uuid4().hex
+    other_worker = models.LabelCache(ttl=0)
+    with api.app.app_context():
+        before = other_worker.translation()
+        models.insert_into_labels(english, "ny")
+        after = other_worker.translation()
+        models.Labels.query.filter_by(english=english).delete()
+        models.db.session.commit()
+        models.invalidate_labels()
+
+    assert english not in before
+    assert after[english] == "ny"
+
+
+def test_increment_counter():
+    """
+        Test that increment_counter adds to the counter and creates it if it
+        doesn't exist.
+    """
+    name = uuid.uuid4().hex[:32]
+    with api.app.app_context():
+        models.increment_counter(name, 2)
+        models.increment_counter(name, 3)
+        value = models.get_counter(name)
+        models.Counters.query.filter_by(name=name).delete()
+        models.db.session.commit()
+
+    assert value == 5
+
+
+def test_increment_counter_start():
+    """
+        Test that a new counter starts from the value returned by start, and
+        that start is not called for existing counters.
+    """
+    name = uuid.uuid4().hex[:32]
+    calls = []
+
+    def start():
+        calls.append(1)
+        return 10
+
+    with api.app.app_context():
+        models.increment_counter(name, 2, start)
+        models.increment_counter(name, 3, start)
+        value = models.get_counter(name)
+        models.Counters.query.filter_by(name=name).delete()
+        models.db.session.commit()
+
+    assert value == 15
+    assert len(calls) == 1
+
+
+def test_delete_old_games():
+    """
+        Test that games older than one hour are deleted together with their
+        players, in batches.
+    """
+    old_date = datetime.datetime.today() - datetime.timedelta(hours=2)
+    game_ids = [uuid.uuid4().hex for i in range(3)]
+    with api.app.app_context():
+        for game_id in game_ids:
+            models.insert_into_games(game_id, cfg.LABELS, old_date)
+            models.insert_into_players(uuid.uuid4().hex, game_id, cfg.STATE)
+
+        deleted = models.delete_old_games(2)
+        remaining = models.Games.query.filter(
+            models.Games.game_id.in_(game_ids)
+        ).count()
+
+    assert deleted >= len(game_ids)
+    assert remaining == 0
+
+
+def test_get_daily_high_score_capped():
+    """
+        Check that the daily high score list has at most top_n entries.
+    """
+    with api.app.app_context():
+        for i in range(3):
+            models.insert_into_scores("Test User", i, datetime.date.today())
+
+        result = models.get_daily_high_score(2)
+
+    assert len(result) == 2
+
+
+def test_job_lock_single_flight():
+    """
+        Test that a job lock can only be held by one job until it is
+        released or its heartbeat is stale.
+    """
+    name = uuid.uuid4().hex[:32]
+    first = str(uuid.uuid4())
+    second = str(uuid.uuid4())
+    with api.app.app_context():
+        assert models.acquire_job_lock(name, first, first, 60)
+        assert not models.acquire_job_lock(name, second, second, 60)
+        assert models.renew_job_lock(name, first)
+        # a lock without a heartbeat for stale_after seconds is taken over
+        assert models.acquire_job_lock(name, second, second, -1)
+        assert not models.renew_job_lock(name, first)
+        models.release_job_lock(name, second)
+        assert models.acquire_job_lock(name, first, first, 60)
+        models.JobLocks.query.filter_by(name=name).delete()
+        models.db.session.commit()
+
+
+def test_job_lock_takeover_same_job():
+    """
+        Test that a run taking over a stale job holds the lock alone, so the
+        run it took over can neither renew nor release it.
+    """
+    name = uuid.uuid4().hex[:32]
+    job_id = str(uuid.uuid4())
+    first = str(uuid.uuid4())
+    second = str(uuid.uuid4())
+    with api.app.app_context():
+        assert models.acquire_job_lock(name, job_id, first, 60)
+        assert models.acquire_job_lock(name, job_id, second, -1)
+        assert not models.renew_job_lock(name, first)
+        models.release_job_lock(name, first)
+        lock = models.get_job_lock(name)
+        assert lock.job_id == job_id
+        assert lock.owner == second
+        assert models.renew_job_lock(name, second)
+        models.JobLocks.query.filter_by(name=name).delete()
+        models.db.session.commit()
+
+
+def test_janitor_lease_single_holder():
+    """
+        Test that only one janitor holds the lease, and that the holder
+        keeps it when it runs again.
+    """
+    first, second = uuid.uuid4().hex, uuid.uuid4().hex
+    with api.app.app_context():
+        first_holds = janitor.has_lease(first)
+        second_holds = janitor.has_lease(second)
+        first_renews = janitor.has_lease(first)
+        models.release_job_lock(janitor.LEASE_NAME, first)
+
+    assert first_holds
+    assert not second_holds
+    assert first_renews
+
+
+def test_get_player_with_game():
+    """
+        Test that the player, its game and the current label are returned
+        as one snapshot.
+    """
+    game_id = uuid.uuid4().hex
+    player_id = uuid.uuid4().hex
+    labels = ["label1", "label2", "label3"]
+    with api.app.app_context():
+        models.insert_into_games(game_id, labels, TestValues.TODAY)
+        models.insert_into_players(player_id, game_id, cfg.STATE)
+        session = models.get_player_with_game(player_id)
+        models.update_game_for_player(game_id, player_id, 1, cfg.STATE)
+        next_session = models.get_player_with_game(player_id)
+        with raises(excp.BadRequest):
+            models.get_player_with_game(uuid.uuid4().hex)
+
+    assert session.game_id == game_id
+    assert session.state == cfg.STATE
+    assert session.session_num == 1
+    assert session.label == "label1"
+    assert next_session.label == "label2"
+
+
+def test_get_player_with_game_legacy_labels():
+    """
+        Test that games with labels stored as json, created before the
+        GameLabels table, are still read.
+    """
+    game_id = uuid.uuid4().hex
+    player_id = uuid.uuid4().hex
+    labels = json.dumps(["label1", "label2", "label3"])
+    with api.app.app_context():
+        models.insert_into_games(game_id, labels, TestValues.TODAY)
+        models.insert_into_players(player_id, game_id, cfg.STATE)
+        session = models.get_player_with_game(player_id)
+        models.delete_session_from_game(game_id)
+
+    assert session.label == "label1"
+
+
+def enforce_foreign_keys(dbapi_connection, connection_record, proxy):
+    """
+        Turns on foreign keys in SQLite, which enforces them per connection.
+        Other databases always enforce them.
+    """
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.close()
+
+
+def test_game_labels_with_foreign_keys():
+    """
+        Test that a game and its labels, added in the same transaction, are
+        inserted in the order required by the foreign key.
+    """
+    game_id = uuid.uuid4().hex
+    saved_game_id = uuid.uuid4().hex
+    player_id = uuid.uuid4().hex
+    with api.app.app_context():
+        engine = models.db.engine
+        sqlite = engine.dialect.name == "sqlite"
+        if sqlite:
+            sqlalchemy.event.listen(engine, "checkout", enforce_foreign_keys)
+            # pooled connections are checked out again with the pragma set
+            engine.dispose()
+        try:
+            models.insert_into_games(game_id, ["label1"], TestValues.TODAY)
+            models.save_game(
+                saved_game_id,
+                player_id,
+                ["label1", "label2"],
+                TestValues.TODAY,
+                1,
+                cfg.STATE,
+            )
+            session = models.get_player_with_game(player_id)
+            models.delete_session_from_game(game_id)
+            models.delete_session_from_game(saved_game_id)
+        finally:
+            if sqlite:
+                sqlalchemy.event.remove(
+                    engine, "checkout", enforce_foreign_keys
+                )
+                # new connections are opened without the pragma
+                engine.dispose()
+
+    assert session.label == "label1"
+
+
+def test_seed_labels_upserts_in_bulk(tmp_path):
+    """
+        Test that seeding inserts missing labels, updates changed
+        translations and leaves unchanged labels alone.
+    """
+    english = [uuid.uuid4().hex, uuid.uuid4().hex]
+    path = tmp_path / "labels.csv"
+    path.write_text(f"{english[0]},en\n{english[1]},to\n")
+    with api.app.app_context():
+        inserted = models.seed_labels(api.app, str(path))
+        unchanged = models.seed_labels(api.app, str(path))
+        path.write_text(f"{english[0]},en\n{english[1]},tre\n")
+        updated = models.seed_labels(api.app, str(path))
+        translation = models.to_norwegian(english[1])
+        models.Labels.query.filter(models.Labels.english.in_(english)).delete(
+            synchronize_session=False
+        )
+        models.db.session.commit()
+        models.invalidate_labels()
+
+    assert inserted == 2
+    assert unchanged == 0
+    assert updated == 1
+    assert translation == "tre"
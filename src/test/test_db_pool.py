@@ -0,0 +1,44 @@
+"""
+    Tests for the instrumented database connection pool.
+"""
+import pytest
+import sqlite3
+from sqlalchemy import exc
+from utilities.db_pool import InstrumentedQueuePool
+
+
+def test_pool_stats_count_checkouts():
+    """
+        Test that checkouts and connections in use are counted.
+    """
+    pool = InstrumentedQueuePool(
+        lambda: sqlite3.connect(":memory:"), pool_size=1, max_overflow=1
+    )
+    first = pool.connect()
+    second = pool.connect()
+    stats = pool.stats()
+    first.close()
+    second.close()
+    assert stats["checkouts"] == 2
+    assert stats["checked_out"] == 2
+    assert stats["overflow"] == 1
+    assert pool.stats()["checked_out"] == 0
+
+
+def test_pool_stats_count_timeouts():
+    """
+        Test that a checkout timing out on a full pool is counted.
+    """
+    pool = InstrumentedQueuePool(
+        lambda: sqlite3.connect(":memory:"),
+        pool_size=1,
+        max_overflow=0,
+        timeout=0.01,
+    )
+    connection = pool.connect()
+    with pytest.raises(exc.TimeoutError):
+        pool.connect()
+    connection.close()
+    stats = pool.stats()
+    assert stats["timeouts"] == 1
+    assert stats["max_wait"] >= 0.01
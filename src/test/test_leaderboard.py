@@ -0,0 +1,117 @@
+"""
+    Tests for the in-memory leaderboard. The tests use the test database.
+"""
+import pytest
+import datetime
+from webapp import api
+from webapp import models
+from webapp.leaderboard import Leaderboard
+from webapp.events import EventBroker
+from webapp.events import RESYNC
+
+
+# every test in this module uses the test database
+pytestmark = pytest.mark.usefixtures("database")
+
+
+def test_insert_is_visible_without_reload():
+    """
+        Test that an inserted score is in the lists returned by view().
+    """
+    board = Leaderboard(top_n=10, sync_interval=60)
+    with api.app.app_context():
+        board.view()
+        board.insert("Leaderboard Test", 1000000, datetime.date.today())
+        data = board.view()
+
+    assert data["total"][0] == {"name": "Leaderboard Test", "score": 1000000}
+    assert data["daily"][0] == {"name": "Leaderboard Test", "score": 1000000}
+
+
+def test_change_by_other_worker_is_loaded():
+    """
+        Test that a score inserted through another leaderboard, as in another
+        worker, is loaded after the version has changed.
+    """
+    board = Leaderboard(top_n=10, sync_interval=0)
+    other_board = Leaderboard(top_n=10, sync_interval=0)
+    with api.app.app_context():
+        board.view()
+        other_board.insert("Other Worker", 2000000, datetime.date.today())
+        data = board.view()
+
+    assert data["total"][0] == {"name": "Other Worker", "score": 2000000}
+
+
+def test_view_keeps_top_n_sorted():
+    """
+        Test that view() returns at most top_n scores sorted descending.
+    """
+    board = Leaderboard(top_n=3, sync_interval=60)
+    with api.app.app_context():
+        for score in [5, 50, 20, 40, 10]:
+            board.insert("Test User", score, datetime.date.today())
+
+        total = [player["score"] for player in board.view()["total"]]
+
+    assert len(total) <= 3
+    assert total == sorted(total, reverse=True)
+
+
+def test_clear_empties_leaderboard():
+    """
+        Test that clear() empties both lists and the Scores table.
+    """
+    board = Leaderboard(top_n=10, sync_interval=60)
+    with api.app.app_context():
+        board.insert("Test User", 10, datetime.date.today())
+        board.clear()
+        data = board.view()
+        num_records = models.Scores.query.count()
+
+    assert data == {"daily": [], "total": []}
+    assert num_records == 0
+
+
+def test_insert_publishes_changed_lists():
+    """
+        Test that inserting a score publishes the changed lists to
+        subscribers.
+    """
+    board = Leaderboard(top_n=10, sync_interval=60)
+    events = board.events.subscribe()
+    with api.app.app_context():
+        board.view()
+        while not events.empty():
+            events.get_nowait()
+
+        board.insert("Stream Test", 3000000, datetime.date.today())
+
+    delta = events.get_nowait()
+    assert delta["total"][0] == {"name": "Stream Test", "score": 3000000}
+
+
+def test_subscribers_are_capped():
+    """
+        Test that no more than max_subscribers queues are handed out, and
+        that a queue is available again after unsubscribing.
+    """
+    broker = EventBroker(max_queue_size=4, max_subscribers=1)
+    events = broker.subscribe()
+    assert broker.subscribe() is None
+    broker.unsubscribe(events)
+    assert broker.subscribe() is not None
+
+
+def test_full_queue_is_resynced():
+    """
+        Test that a subscriber that falls behind gets RESYNC instead of
+        silently missing events.
+    """
+    broker = EventBroker(max_queue_size=2)
+    events = broker.subscribe()
+    for i in range(3):
+        broker.publish({"total": [i]})
+
+    assert events.get_nowait() == RESYNC
+    assert events.empty()
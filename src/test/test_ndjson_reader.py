@@ -0,0 +1,56 @@
+"""
+    Tests for the random access reader of Quick Draw .ndjson files.
+"""
+import os
+import json
+from preprocessing.ndjson_reader import NdjsonReader
+from preprocessing.ndjson_reader import INDEX_SUFFIX
+
+
+def write_drawings(path, n):
+    """
+        Writes n drawings, every second one recognized, to path.
+    """
+    with open(path, "w") as f:
+        for i in range(n):
+            drawing = {"key_id": str(i), "recognized": i % 2 == 0}
+            f.write(json.dumps(drawing) + "\n")
+
+
+def test_index_is_built_and_reused(tmp_path):
+    """
+        Test that the offset index finds every line and is stored next to
+        the file.
+    """
+    path = str(tmp_path / "cat.ndjson")
+    write_drawings(path, 10)
+    assert len(NdjsonReader(path)) == 10
+    assert os.path.isfile(path + INDEX_SUFFIX)
+    assert len(NdjsonReader(path)) == 10
+
+
+def test_sample_filters(tmp_path):
+    """
+        Test that sampled drawings are unique, recognized and not skipped,
+        with and without the index.
+    """
+    path = str(tmp_path / "cat.ndjson")
+    write_drawings(path, 100)
+    skip_keys = set(str(i) for i in range(0, 50))
+    for use_index in (True, False):
+        reader = NdjsonReader(path, use_index)
+        drawings = reader.sample(10, True, skip_keys, seed=1)
+        keys = [d["key_id"] for d in drawings]
+        assert len(set(keys)) == 10
+        assert all(d["recognized"] for d in drawings)
+        assert not skip_keys.intersection(keys)
+
+
+def test_head_returns_first_drawings(tmp_path):
+    """
+        Test that head returns the first n drawings in file order.
+    """
+    path = str(tmp_path / "cat.ndjson")
+    write_drawings(path, 10)
+    drawings = NdjsonReader(path).head(3)
+    assert [d["key_id"] for d in drawings] == ["0", "1", "2"]
@@ -0,0 +1,96 @@
+"""
+    Tests for the session stores keeping the state of live games.
+"""
+import uuid
+import time
+import datetime
+import pytest
+import threading
+from pytest import raises
+from werkzeug import exceptions as excp
+from webapp import api
+from webapp import models
+from webapp.memory_store import MemoryStore
+from webapp.sessions import KeyValueSessionStore
+from utilities import setup
+
+
+# every test in this module uses the test database
+pytestmark = pytest.mark.usefixtures("database")
+
+
+def test_memory_store_expires_keys():
+    """
+        Test that keys set with an expiry are gone after it.
+    """
+    store = MemoryStore()
+    store.set("kept", "1")
+    store.set("expired", "2", ex=0.01)
+    time.sleep(0.02)
+    assert store.get("kept") == "1"
+    assert store.get("expired") is None
+    assert store.delete("kept", "expired") == 1
+
+
+def test_memory_session_store_writes_finished_games():
+    """
+        Test that the memory session store keeps live games out of the
+        database and writes the game when its last session is done.
+    """
+    store = KeyValueSessionStore(MemoryStore(), setup.SESSION_TTL)
+    game_id = uuid.uuid4().hex
+    player_id = uuid.uuid4().hex
+    labels = ["cat", "dog", "cow"]
+    with api.app.app_context():
+        store.start(game_id, player_id, labels, datetime.datetime.today())
+        assert store.get(player_id).label == "cat"
+        for i in range(setup.NUM_GAMES - 1):
+            store.advance(game_id, player_id, "Done")
+
+        assert models.Games.query.get(game_id) is None
+        store.advance(game_id, player_id, "Done")
+        game = models.get_game(game_id)
+        assert game.session_num == setup.NUM_GAMES + 1
+
+        store.finish(game_id, player_id)
+        assert models.Games.query.get(game_id) is None
+
+
+def test_finish_game_never_written():
+    """
+        Test that finishing a game that was never written to the database
+        only removes it from the store.
+    """
+    store = KeyValueSessionStore(MemoryStore(), setup.SESSION_TTL)
+    game_id = uuid.uuid4().hex
+    player_id = uuid.uuid4().hex
+    with api.app.app_context():
+        store.start(game_id, player_id, ["cat"], datetime.datetime.today())
+        store.finish(game_id, player_id)
+        with raises(excp.BadRequest):
+            store.get(player_id)
+
+
+def test_concurrent_advance_keeps_every_update(monkeypatch):
+    """
+        Test that sessions advanced by concurrent requests are all counted.
+    """
+    # the game is not finished, so it is not written to the database
+    monkeypatch.setattr(setup, "NUM_GAMES", 20)
+    store = KeyValueSessionStore(MemoryStore(), setup.SESSION_TTL)
+    game_id = uuid.uuid4().hex
+    player_id = uuid.uuid4().hex
+    labels = [str(i) for i in range(20)]
+    store.start(game_id, player_id, labels, datetime.datetime.today())
+    threads = [
+        threading.Thread(
+            target=store.advance, args=(game_id, player_id, "Playing")
+        )
+        for i in range(10)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert store.get(player_id).session_num == 11
@@ -0,0 +1,112 @@
+"""
+    Tests for the background upload queue used by storage.save_image.
+"""
+import os
+import time
+import threading
+from webapp.upload_queue import UploadQueue
+
+
+def queue_helper(upload, on_uploaded, spill_dir, max_size=4):
+    """
+        Helper function creating an upload queue with short delays.
+    """
+    return UploadQueue(
+        upload,
+        on_uploaded,
+        max_size=max_size,
+        batch_size=2,
+        retries=2,
+        retry_delay=0.01,
+        flush_interval=0.05,
+        spill_dir=str(spill_dir),
+    )
+
+
+def wait_for(condition, timeout=5):
+    """
+        Helper function waiting until condition() is true.
+    """
+    end = time.time() + timeout
+    while not condition() and time.time() < end:
+        time.sleep(0.01)
+
+    return condition()
+
+
+def test_all_images_uploaded_and_counted(tmp_path):
+    """
+        Test that every queued image is uploaded, also when the queue is full
+        and images are spilled to disk, and that the image count is updated
+        with the number of uploads.
+    """
+    uploaded = []
+    counts = []
+    upload_queue = queue_helper(
+        lambda name, data: uploaded.append(name), counts.append, tmp_path
+    )
+    names = [f"label/{i}.png" for i in range(10)]
+    for name in names:
+        upload_queue.put(name, b"image")
+
+    assert wait_for(lambda: len(uploaded) == len(names))
+    assert sorted(uploaded) == sorted(names)
+    assert wait_for(lambda: sum(counts) == len(names))
+
+
+def test_failed_upload_is_retried(tmp_path):
+    """
+        Test that an image is uploaded after a failed attempt.
+    """
+    attempts = []
+
+    def upload(name, data):
+        attempts.append(name)
+        if len(attempts) == 1:
+            raise IOError("upload failed")
+
+    upload_queue = queue_helper(upload, lambda n: None, tmp_path)
+    upload_queue.put("label/image.png", b"image")
+    assert wait_for(lambda: upload_queue.stats()["uploaded"] == 1)
+    assert len(attempts) == 2
+
+
+def test_files_of_dead_process_are_reclaimed(tmp_path):
+    """
+        Test that a file claimed by a process that died is uploaded, and
+        that its partial files are removed.
+    """
+    # larger than the maximum pid, so no process has it
+    dead_pid = 99999999
+    (tmp_path / f"label%2Fclaimed.png.{dead_pid}.claimed").write_bytes(b"a")
+    (tmp_path / f"label%2Fpartial.png.{dead_pid}.partial").write_bytes(b"b")
+    uploaded = []
+    upload_queue = queue_helper(
+        lambda name, data: uploaded.append(name), lambda n: None, tmp_path
+    )
+    upload_queue.put("label/new.png", b"image")
+    assert wait_for(lambda: len(uploaded) == 2)
+    assert sorted(uploaded) == ["label/claimed.png", "label/new.png"]
+    assert wait_for(lambda: os.listdir(str(tmp_path)) == [])
+
+
+def test_batch_in_flight_is_spilled_on_exit(tmp_path):
+    """
+        Test that the batch being uploaded when the process exits is
+        spilled to disk.
+    """
+    started = threading.Event()
+    release = threading.Event()
+
+    def upload(name, data):
+        started.set()
+        release.wait(5)
+
+    upload_queue = queue_helper(upload, lambda n: None, tmp_path)
+    upload_queue.put("label/image.png", b"image")
+    assert started.wait(5)
+    # called by atexit when the process exits
+    upload_queue._UploadQueue__spill_queue()
+    spilled = os.listdir(str(tmp_path))
+    release.set()
+    assert spilled == ["label%2Fimage.png"]
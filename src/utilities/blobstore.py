@@ -0,0 +1,137 @@
+"""
+    Blob storage backends used for the drawings. A backend stores blobs in
+    named containers, where each blob is named label/key.png. The backend is
+    selected with setup.BLOB_BACKEND, "azure" for Azure Blob Storage or
+    "local" for a directory on disk.
+"""
+from typing import Dict
+from typing import Iterator
+from azure.core.exceptions import ResourceExistsError
+from utilities.keys import Keys
+from utilities import clients
+from utilities import setup
+
+
+class BlobStore:
+    """
+        Interface for blob storage backends. Uploading a blob that exists
+        without overwrite, or creating a container that exists, raises
+        ResourceExistsError in every backend.
+    """
+
+    def upload(self, container: str, name: str, data: bytes, overwrite=True):
+        """
+            Stores data as blob name in the container.
+        """
+        raise NotImplementedError
+
+    def download(self, container: str, name: str) -> bytes:
+        """
+            Returns the content of the blob.
+        """
+        raise NotImplementedError
+
+    def list_names(self, container: str, prefix: str = "") -> Iterator[str]:
+        """
+            Yields the names of the blobs in the container starting with
+            prefix.
+        """
+        raise NotImplementedError
+
+    def create_container(self, container: str, metadata=None) -> None:
+        """
+            Creates the container with the given metadata.
+        """
+        raise NotImplementedError
+
+    def delete_container(self, container: str) -> None:
+        """
+            Deletes the container and all its blobs.
+        """
+        raise NotImplementedError
+
+    def get_metadata(self, container: str) -> Dict[str, str]:
+        """
+            Returns the metadata of the container.
+        """
+        raise NotImplementedError
+
+    def url(self, container: str, name: str) -> str:
+        """
+            Returns the URL of the blob.
+        """
+        raise NotImplementedError
+
+
+class AzureBlobStore(BlobStore):
+    """
+        Stores blobs in Azure Blob Storage, using the shared clients.
+    """
+
+    def upload(self, container, name, data, overwrite=True):
+        client = clients.container_client(container)
+        client.upload_blob(name, data, overwrite=overwrite)
+
+    def download(self, container, name):
+        client = clients.container_client(container)
+        return client.download_blob(name).readall()
+
+    def list_names(self, container, prefix=""):
+        client = clients.container_client(container)
+        for blob in client.list_blobs(name_starts_with=prefix or None):
+            yield blob.name
+
+    def create_container(self, container, metadata=None):
+        # the images are read by Custom Vision through public URLs
+        clients.container_client(container).create_container(
+            metadata=metadata, public_access="container"
+        )
+
+    def delete_container(self, container):
+        clients.container_client(container).delete_container()
+
+    def get_metadata(self, container):
+        client = clients.container_client(container)
+        return client.get_container_properties().metadata
+
+    def url(self, container, name):
+        return f"{Keys.get('BASE_BLOB_URL')}/{container}/{name}"
+
+
+def get_blobstore() -> BlobStore:
+    """
+        Returns the blob storage backend selected with setup.BLOB_BACKEND.
+        The backend is created once per process.
+    """
+    return clients.get_client("blobstore", create_blobstore)
+
+
+def create_blobstore() -> BlobStore:
+    """
+        Creates the blob storage backend selected with setup.BLOB_BACKEND.
+    """
+    if setup.BLOB_BACKEND == "azure":
+        return AzureBlobStore()
+    elif setup.BLOB_BACKEND == "local":
+        from utilities.local_blobstore import LocalBlobStore
+
+        return LocalBlobStore(setup.LOCAL_BLOB_DIR)
+    else:
+        raise ValueError("Unknown blob backend: " + str(setup.BLOB_BACKEND))
+
+
+def sync(source: BlobStore, target: BlobStore, container: str) -> int:
+    """
+        Copies the blobs of the container in source that are missing in
+        target, e.g. images saved by a node using the local backend to Azure.
+        The container must exist in target. Returns the number of copied
+        blobs.
+    """
+    existing = set(target.list_names(container))
+    copied = 0
+    for name in source.list_names(container):
+        if name not in existing:
+            target.upload(container, name, source.download(container, name))
+            copied += 1
+
+    return copied
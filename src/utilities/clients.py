@@ -0,0 +1,131 @@
+"""
+    Shared Azure clients. Each client is created once per process and keeps
+    its HTTP connections alive between requests, instead of opening a new
+    session and TLS connection per call. The registry is emptied in forked
+    processes, so gunicorn workers started with --preload never share
+    connections with the master process.
+"""
+import os
+import threading
+import requests
+from azure.core.pipeline.transport import RequestsTransport
+from azure.storage.blob import BlobServiceClient
+from msrest.authentication import ApiKeyCredentials
+from azure.cognitiveservices.vision.customvision.prediction import (
+    CustomVisionPredictionClient,
+)
+from azure.cognitiveservices.vision.customvision.training import (
+    CustomVisionTrainingClient,
+)
+from utilities.keys import Keys
+from utilities import setup
+
+clients = {}
+clients_lock = threading.Lock()
+
+
+def reset():
+    """
+        Forget all clients. Called in the child process after a fork.
+    """
+    global clients_lock
+    clients.clear()
+    clients_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=reset)
+
+
+def get_client(name, create):
+    """
+        Returns the client registered as name, creating it with create() on
+        first use.
+    """
+    client = clients.get(name)
+    if client is None:
+        with clients_lock:
+            client = clients.get(name)
+            if client is None:
+                client = create()
+                clients[name] = client
+
+    return client
+
+
+def http_session():
+    """
+        Returns a requests session with a connection pool sized for the
+        threads of a worker.
+    """
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=setup.HTTP_POOL_CONNECTIONS,
+        pool_maxsize=setup.HTTP_POOL_SIZE,
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def blob_service_client():
+    """
+        Returns the shared BlobServiceClient.
+    """
+
+    def create():
+        transport = RequestsTransport(
+            session=http_session(), session_owner=False
+        )
+        return BlobServiceClient.from_connection_string(
+            Keys.get("BLOB_CONNECTION_STRING"), transport=transport
+        )
+
+    return get_client("blob_service", create)
+
+
+def container_client(container_name):
+    """
+        Returns a shared ContainerClient. It uses the connection pool of the
+        BlobServiceClient.
+    """
+    return get_client(
+        "container/" + container_name,
+        lambda: blob_service_client().get_container_client(container_name),
+    )
+
+
+def prediction_client():
+    """
+        Returns the shared Custom Vision prediction client.
+    """
+
+    def create():
+        credentials = ApiKeyCredentials(
+            in_headers={"Prediction-key": Keys.get("CV_PREDICTION_KEY")}
+        )
+        client = CustomVisionPredictionClient(
+            Keys.get("CV_ENDPOINT"), credentials
+        )
+        # msrest closes the session after every request unless kept alive
+        client.config.keep_alive = True
+        return client
+
+    return get_client("cv_prediction", create)
+
+
+def training_client():
+    """
+        Returns the shared Custom Vision training client.
+    """
+
+    def create():
+        credentials = ApiKeyCredentials(
+            in_headers={"Training-key": Keys.get("CV_TRAINING_KEY")}
+        )
+        client = CustomVisionTrainingClient(
+            Keys.get("CV_ENDPOINT"), credentials
+        )
+        client.config.keep_alive = True
+        return client
+
+    return get_client("cv_training", create)
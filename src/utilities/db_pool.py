@@ -0,0 +1,58 @@
+"""
+    Connection pool for the database engine, recording how long requests
+    wait for a connection.
+"""
+import time
+import threading
+from sqlalchemy import exc
+from sqlalchemy.pool import QueuePool
+
+
+class InstrumentedQueuePool(QueuePool):
+    """
+        QueuePool counting checkouts, timeouts and the time spent waiting
+        for a connection. The wait includes opening a new connection when
+        the pool has room for one.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkouts = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.__stats_lock = threading.Lock()
+
+    def _do_get(self):
+        start = time.monotonic()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            with self.__stats_lock:
+                self.timeouts += 1
+            raise
+        finally:
+            wait = time.monotonic() - start
+            with self.__stats_lock:
+                self.checkouts += 1
+                self.total_wait += wait
+                self.max_wait = max(self.max_wait, wait)
+
+    def stats(self):
+        """
+            Returns the pool size, the connections in use and the wait
+            statistics of this process.
+        """
+        with self.__stats_lock:
+            average = self.total_wait / self.checkouts if self.checkouts else 0
+            return {
+                "size": self.size(),
+                "checked_out": self.checkedout(),
+                "checked_in": self.checkedin(),
+                "overflow": max(self.overflow(), 0),
+                "max_overflow": self._max_overflow,
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "average_wait": round(average, 4),
+                "max_wait": round(self.max_wait, 4),
+            }
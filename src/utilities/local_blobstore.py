@@ -0,0 +1,144 @@
+"""
+    Blob storage backend keeping the blobs in a local directory, for
+    development, tests and nodes without a connection to Azure.
+"""
+import os
+import json
+import shutil
+from azure.core.exceptions import ResourceExistsError
+from azure.core.exceptions import ResourceNotFoundError
+from utilities.blobstore import BlobStore
+
+# Suffix of files being written, which are never listed
+PARTIAL_SUFFIX = ".partial"
+# Suffix of the sidecar file with the metadata of a container
+METADATA_SUFFIX = ".metadata.json"
+
+
+class LocalBlobStore(BlobStore):
+    """
+        Stores every container as a directory under root, with the same
+        label/key.png layout as in Azure. The metadata of a container is
+        stored in a sidecar file next to its directory. Containers are
+        created on first upload.
+    """
+
+    def __init__(self, root: str) -> None:
+        self.root = root
+
+    def upload(self, container, name, data, overwrite=True):
+        path = self.__path(container, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if hasattr(data, "read"):
+            data = data.read()
+
+        # write to a partial file first so readers never see half a blob
+        partial = f"{path}.{os.getpid()}{PARTIAL_SUFFIX}"
+        with open(partial, "wb") as blob_file:
+            blob_file.write(data)
+
+        if overwrite:
+            os.replace(partial, path)
+            return
+
+        try:
+            self.__create(partial, path)
+        except FileExistsError:
+            raise ResourceExistsError(f"The blob {name} already exists")
+        finally:
+            if os.path.exists(partial):
+                os.remove(partial)
+
+    def download(self, container, name):
+        try:
+            with open(self.__path(container, name), "rb") as blob_file:
+                return blob_file.read()
+        except FileNotFoundError:
+            raise ResourceNotFoundError(f"The blob {name} does not exist")
+
+    def list_names(self, container, prefix=""):
+        container_dir = os.path.join(self.root, container)
+        names = []
+        for directory, subdirectories, files in os.walk(container_dir):
+            relative = os.path.relpath(directory, container_dir)
+            for file_name in files:
+                if file_name.endswith(PARTIAL_SUFFIX):
+                    continue
+
+                name = file_name
+                if relative != os.curdir:
+                    name = relative.replace(os.sep, "/") + "/" + file_name
+                if name.startswith(prefix):
+                    names.append(name)
+
+        return iter(sorted(names))
+
+    def create_container(self, container, metadata=None):
+        try:
+            os.makedirs(os.path.join(self.root, container))
+        except FileExistsError:
+            raise ResourceExistsError(f"The container {container} exists")
+
+        self.__write_metadata(container, metadata or {})
+
+    def delete_container(self, container):
+        container_dir = os.path.join(self.root, container)
+        if not os.path.isdir(container_dir):
+            raise ResourceNotFoundError(f"No container named {container}")
+
+        shutil.rmtree(container_dir)
+        metadata_path = container_dir + METADATA_SUFFIX
+        if os.path.isfile(metadata_path):
+            os.remove(metadata_path)
+
+    def get_metadata(self, container):
+        metadata_path = os.path.join(self.root, container) + METADATA_SUFFIX
+        if not os.path.isfile(metadata_path):
+            return {}
+
+        with open(metadata_path) as metadata_file:
+            return json.load(metadata_file)
+
+    def url(self, container, name):
+        # a local path, which is what the classifier opens for non-http URLs
+        return self.__path(container, name)
+
+    def __create(self, partial, path):
+        """
+            Moves the partial file to path, raising FileExistsError if path
+            exists. Uses a hard link where the filesystem supports it, else
+            reserves path with an exclusive create before the rename.
+        """
+        try:
+            os.link(partial, path)
+            return
+        except FileExistsError:
+            raise
+        except OSError:
+            # no hard links, e.g. on some SMB and FAT mounts
+            pass
+
+        os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        os.replace(partial, path)
+
+    def __path(self, container, name):
+        """
+            Returns the path of the blob, refusing names outside the
+            container.
+        """
+        container_dir = os.path.abspath(os.path.join(self.root, container))
+        path = os.path.abspath(os.path.join(container_dir, name))
+        if not path.startswith(container_dir + os.sep):
+            raise ValueError(f"Invalid blob name: {name}")
+
+        return path
+
+    def __write_metadata(self, container, metadata):
+        """
+            Writes the metadata sidecar of the container.
+        """
+        metadata_path = os.path.join(self.root, container) + METADATA_SUFFIX
+        partial = metadata_path + PARTIAL_SUFFIX
+        with open(partial, "w") as metadata_file:
+            json.dump(metadata, metadata_file)
+        os.replace(partial, metadata_path)
@@ -1,26 +1,113 @@
 import sys
 import os
 from utilities.keys import Keys
+from utilities.db_pool import InstrumentedQueuePool
 
 # number of players in overall high score top list
 TOP_N = 10
+# Seconds between checks for high scores changed by other workers
+LEADERBOARD_SYNC_INTERVAL = 5
+# Seconds shared caches may serve the high score list without revalidating
+HIGH_SCORE_MAX_AGE = 5
+# Seconds between keepalives on the high score stream, each also checks for
+# high scores changed by other workers
+SSE_HEARTBEAT_INTERVAL = 5
+# Maximum number of events waiting per high score stream client
+SSE_QUEUE_SIZE = 16
+# Maximum number of high score streams per worker. Every stream holds one of
+# the threads of the worker, the rest are kept free for the game.
+SSE_MAX_STREAMS = int(os.environ.get("SSE_MAX_STREAMS", 4))
 # Total number of games
 NUM_GAMES = 3
+# Store for the state of live games, "sql", "memory" or "redis", see
+# webapp/sessions.py. "memory" is only shared by threads of one worker.
+SESSION_STORE = os.environ.get("SESSION_STORE", "sql")
+# Seconds the state of a game is kept in the memory or redis store
+SESSION_TTL = 3600
+# Redis server used by the redis session store
+REDIS_URL = os.environ.get("REDIS_URL", "redis://localhost:6379/0")
 # certainties from costum vision lower than this -> haswon=False
 CERTAINTY_THRESHOLD = 0.7
 # certainty threhold for saving images to BLOB storage for training
 SAVE_CERTAINTY = 0.3
+# threads listing blobs and uploading chunks in Classifier.upload_images
+CV_UPLOAD_WORKERS = 8
+# directory with the names of the images already uploaded to Custom Vision
+UPLOAD_MANIFEST_DIR = "./customvision/manifests"
 # custom vision can't have more than 10 iterations at a time, if more classifier.py will delete the oldest iteration
 CV_MAX_ITERATIONS = 10
+# threads used by Classifier.predict_batch
+CV_BATCH_WORKERS = 8
+# retries of throttled predictions, and seconds before the first retry
+CV_MAX_RETRIES = 5
+CV_BACKOFF_DELAY = 1
+# seconds between polls of training and image deletion, doubled per poll up
+# to the maximum, and seconds to wait for all images to be deleted
+CV_POLL_DELAY = 1
+CV_POLL_MAX_DELAY = 30
+CV_DELETE_TIMEOUT = 600
 # can't upload more than 64 images at a time, if more
 CV_MAX_IMAGES = 64
 # The guess provided to the user when the image is blank
 WHITE_IMAGE_GUESS = "blank image"
+# Side length of the downscaled image used to detect blank images
+BLANK_IMAGE_SIZE = 64
+# Grayscale value below which a downscaled pixel counts as drawn
+BLANK_PIXEL_THRESHOLD = 200
+# Images with at most this many drawn pixels are treated as blank
+BLANK_MAX_DRAWN_PIXELS = 4
 # Authorization cookie expiration time in minutes
 SESSION_EXPIRATION_TIME = 10
 # Maximum file size and minimum resolution for CV classification
 MAX_IMAGE_SIZE = 4000000
 MIN_RESOLUTION = 256
+# Maximum request body, the image and room for the form fields. Larger
+# requests are rejected before the body is parsed.
+MAX_REQUEST_SIZE = MAX_IMAGE_SIZE + 65536
+# Number of bytes read at a time when receiving images
+UPLOAD_CHUNK_SIZE = 65536
+# Prediction backend used by the classifier, "customvision" or "onnx"
+PREDICTION_BACKEND = os.environ.get("PREDICTION_BACKEND", "customvision")
+# Model and labels exported from Custom Vision, used by the onnx backend
+ONNX_MODEL_PATH = "./customvision/model/model.onnx"
+ONNX_LABELS_PATH = "./customvision/model/labels.txt"
+# Timeout in seconds when downloading images for local prediction
+IMAGE_DOWNLOAD_TIMEOUT = 30
+# Seconds the classifier caches the iteration name before reading it again
+ITERATION_CACHE_TTL = 60
+# Seconds between checks for labels changed through another worker
+LABEL_CACHE_TTL = 10
+# Number of predictions cached by the classifier
+PREDICTION_CACHE_SIZE = 1024
+# Side length of the downscaled image used to hash images for the cache
+PREDICTION_HASH_SIZE = 16
+# Maximum number of images waiting in memory for upload to blob storage
+UPLOAD_QUEUE_SIZE = 256
+# Maximum number of images uploaded per batch
+UPLOAD_BATCH_SIZE = 16
+# Number of attempts per image upload, and seconds before the first retry
+UPLOAD_RETRIES = 3
+UPLOAD_RETRY_DELAY = 1
+# Seconds between checks for images spilled to disk
+UPLOAD_FLUSH_INTERVAL = 30
+# Directory for images that don't fit in the upload queue
+UPLOAD_SPILL_DIR = "./upload_spill"
+# Connection pools per HTTP session and connections kept per pool, should
+# be at least the number of threads in a gunicorn worker
+HTTP_POOL_CONNECTIONS = 4
+HTTP_POOL_SIZE = 16
+# Seconds between each cleanup of expired games, and games deleted per batch
+JANITOR_INTERVAL = 300
+JANITOR_BATCH_SIZE = 500
+# Seconds between heartbeats of a running admin job, seconds without a
+# heartbeat before another worker takes it over, and seconds between checks
+JOB_HEARTBEAT_INTERVAL = 10
+JOB_STALE_AFTER = 60
+JOB_WATCH_INTERVAL = 30
+# Blob storage backend, "azure" or "local", and the directory used by the
+# local backend
+BLOB_BACKEND = os.environ.get("BLOB_BACKEND", "azure")
+LOCAL_BLOB_DIR = os.environ.get("LOCAL_BLOB_DIR", "./blobs")
 # Container names
 CONTAINER_NAME_ORIGINAL = "oldimgcontainer"
 CONTAINER_NAME_NEW = "newimgcontainer"
@@ -28,6 +115,14 @@ CONTAINER_NAME_NEW = "newimgcontainer"
 CREATE_CONTAINER_TRIES = 10
 # Waiting interval in seconds for creating new container after deletion
 CREATE_CONTAINER_WAITER = 30
+# Database connections kept per worker, extra connections allowed when they
+# are all in use, and seconds to wait for a free connection. Overridden by
+# the environment variables with the same name, set by startapp.sh.
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", 5))
+DB_POOL_TIMEOUT = int(os.environ.get("DB_POOL_TIMEOUT", 30))
+# Seconds before a connection is replaced, below the idle timeout of Azure SQL
+DB_POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", 1200))
 
 
 # Object used to initialize Flask instance
@@ -44,9 +139,24 @@ class Flask_config:
         # Connection string for production database
         con_str = Keys.get("DB_CONNECTION_STRING")
 
+    # reject oversized uploads before they are buffered
+    MAX_CONTENT_LENGTH = MAX_REQUEST_SIZE
+
     # database settings
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     SQLALCHEMY_DATABASE_URI = con_str
+    # pre_ping replaces connections closed by the server while idle
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        "poolclass": InstrumentedQueuePool,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": True,
+    }
+    if con_str.startswith("mssql+pyodbc"):
+        # send bulk inserts and updates as one batch instead of per row
+        SQLALCHEMY_ENGINE_OPTIONS["fast_executemany"] = True
 
     # secret key for cookie encryption
     SECRET_KEY = Keys.get("SECRET_KEY")
@@ -7,56 +7,106 @@
         /classify : Classify an image
         /endGame : Signal from client that the game is finished
         /viewHighScore : Provide clien with the highscore from the game
+        /highScoreStream : Push highscore updates to the client
 """
 import uuid
+import queue
 import random
 import time
 import sys
 import os
 import logging
 import json
+import struct
 import datetime
+import threading
 from PIL import Image
-from PIL import ImageChops
-from threading import Thread
 from io import BytesIO
 from webapp import storage
 from webapp import models
+from webapp import janitor
+from webapp.leaderboard import leaderboard
+from webapp.events import RESYNC
+from webapp.jobs import job_manager
+from webapp.sessions import session_store
 from utilities import setup
 from customvision.classifier import Classifier
+from customvision.cache import grayscale
+from flask import Blueprint
 from flask import Flask
+from flask import current_app
 from flask import request
+from flask import make_response
+from flask import Response
 from flask import session
 from flask_sqlalchemy import SQLAlchemy
 from werkzeug.security import generate_password_hash
 from werkzeug.security import check_password_hash
 from werkzeug import exceptions as excp
 
-# Initialization app
-app = Flask(__name__)
-app.config.from_object("utilities.setup.Flask_config")
+# Endpoints, registered on the app by create_app()
+bp = Blueprint("api", __name__)
 
-# Set up DB and models
-models.db.init_app(app)
-models.create_tables(app)
-models.seed_labels(app, "./dict_eng_to_nor.csv")
+# CV classifier of this process, created on first use by get_classifier()
+classifier = None
+classifier_lock = threading.Lock()
 
-# Initialize CV classifier
-classifier = Classifier()
+# First bytes of every png file
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
 
-if __name__ != "__main__":
-    gunicorn_logger = logging.getLogger("gunicorn.error")
-    app.logger.handlers = gunicorn_logger.handlers
-    app.logger.setLevel(gunicorn_logger.level)
 
+def create_app():
+    """
+        Creates the Flask app. Nothing is read from the database or Custom
+        Vision here, so workers start fast. The tables, labels and iteration
+        name are set up once per deployment by webapp.init, before the
+        workers are started.
+    """
+    app = Flask(__name__)
+    app.config.from_object("utilities.setup.Flask_config")
+
+    # Set up DB and models
+    models.db.init_app(app)
+    app.register_blueprint(bp)
+
+    if __name__ != "__main__":
+        gunicorn_logger = logging.getLogger("gunicorn.error")
+        app.logger.handlers = gunicorn_logger.handlers
+        app.logger.setLevel(gunicorn_logger.level)
+
+    return app
+
+
+def get_classifier():
+    """
+        Returns the CV classifier of this process, creating it on first use.
+    """
+    global classifier
+    if classifier is None:
+        with classifier_lock:
+            if classifier is None:
+                classifier = Classifier()
+
+    return classifier
 
-@app.route("/")
+
+@bp.before_app_request
+def start_background_jobs():
+    """
+        Starts the background jobs of this worker on its first request.
+    """
+    app = current_app._get_current_object()
+    janitor.start(app)
+    job_manager.start(app, get_classifier())
+
+
+@bp.route("/")
 def hello():
-    app.logger.info("We're up!")
+    current_app.logger.info("We're up!")
     return "Yes, we're up", 200
 
 
-@app.route("/startGame")
+@bp.route("/startGame")
 def start_game():
     """
         Starts a new game by providing the client with a unique game id and player id.
@@ -66,8 +116,7 @@ def start_game():
     player_id = uuid.uuid4().hex
     labels = models.get_n_labels(setup.NUM_GAMES)
     today = datetime.datetime.today()
-    models.insert_into_games(game_id, json.dumps(labels), today)
-    models.insert_into_players(player_id, game_id, "Playing")
+    session_store.start(game_id, player_id, labels, today)
     # return game data as json object
     data = {
         "player_id": player_id,
@@ -75,27 +124,25 @@ def start_game():
     return json.dumps(data), 200
 
 
-@app.route("/getLabel", methods=["POST"])
+@bp.route("/getLabel", methods=["POST"])
 def get_label():
     """
         Provides the client with a new word.
     """
     player_id = request.values["player_id"]
-    player = models.get_player(player_id)
-    game = models.get_game(player.game_id)
+    game = session_store.get(player_id)
 
     # Check if game complete
     if game.session_num > setup.NUM_GAMES:
         raise excp.BadRequest("Number of games exceeded")
 
-    labels = json.loads(game.labels)
-    label = labels[game.session_num - 1]
+    label = game.label
     norwegian_label = models.to_norwegian(label)
     data = {"label": norwegian_label}
     return json.dumps(data), 200
 
 
-@app.route("/classify", methods=["POST"])
+@bp.route("/classify", methods=["POST"])
 def classify():
     """
         Classify endpoint for continuous guesses.
@@ -107,18 +154,26 @@ def classify():
 
     # Retrieve the image and check if it satisfies constraints
     image = request.files["image"]
-    allowed_file(image)
+    image_data = allowed_file(image)
     # use player_id submitted by player to find game
     player_id = request.values["player_id"]
     # Get time from POST request
     time_left = float(request.values["time"])
     # Get label for game session
-    player = models.get_player(player_id)
-    game = models.get_game(player.game_id)
-    labels = json.loads(game.labels)
-    label = labels[game.session_num - 1]
+    game = session_store.get(player_id)
+    label = game.label
+    translation = models.get_translation_dict()
+
+    # Blank drawings are answered without asking the classifier
+    drawing = Image.open(BytesIO(image_data))
+    if white_image(drawing):
+        return white_image_data(
+            translation[label], time_left, game.game_id, player_id
+        )
 
-    certainty, best_guess = classifier.predict_image(image)
+    certainty, best_guess = get_classifier().predict_image(
+        BytesIO(image_data), drawing
+    )
     best_certainty = certainty[best_guess]
     # The player has won if the game is completed within the time limit
     has_won = (
@@ -129,13 +184,12 @@ def classify():
     # End game if player win or loose
     if has_won or time_left <= 0:
         # Update session_num in game and state for player
-        models.update_game_for_player(player.game_id, player_id, 1, "Done")
+        session_store.advance(game.game_id, player_id, "Done")
         # save image
-        storage.save_image(image, label, best_certainty)
+        storage.save_image(image_data, label, best_certainty)
         # Update game state to be done
         game_state = "Done"
     # translate labels into norwegian
-    translation = models.get_translation_dict()
     certainty_translated = dict(
         [
             (translation[label], probability)
@@ -152,7 +206,7 @@ def classify():
     return json.dumps(data), 200
 
 
-@app.route("/endGame", methods=["POST"])
+@bp.route("/endGame", methods=["POST"])
 def end_game():
     """
         Endpoint for ending game consisting of NUM_GAMES sessions.
@@ -160,39 +214,81 @@ def end_game():
     player_id = request.values["player_id"]
     name = request.values["name"]
     score = float(request.values["score"])
-    player = models.get_player(player_id)
-    game = models.get_game(player.game_id)
+    game = session_store.get(player_id)
 
     if game.session_num != setup.NUM_GAMES + 1:
         raise excp.BadRequest("Game not finished")
 
     today = datetime.date.today()
-    models.insert_into_scores(name, score, today)
+    leaderboard.insert(name, score, today)
 
-    # Clean database for unnecessary data
-    models.delete_session_from_game(player.game_id)
-    models.delete_old_games()
+    # Clean database for unnecessary data, the janitor removes old games
+    session_store.finish(game.game_id, player_id)
     return json.dumps({"success": "OK"}), 200
 
 
-@app.route("/viewHighScore")
+@bp.route("/viewHighScore")
 def view_high_score():
     """
-        Read highscore from database. Return top n of all time and daily high
-        scores.
+        Read highscore from the in-memory leaderboard. Return top n of all
+        time and daily high scores. Clients sending the ETag of their copy in
+        If-None-Match get 304 Not Modified if the high scores are unchanged.
     """
-    # read top n overall high score
-    top_n_high_scores = models.get_top_n_high_score_list(setup.TOP_N)
-    # read daily high score
-    daily_high_scores = models.get_daily_high_score()
-    data = {
-        "daily": daily_high_scores,
-        "total": top_n_high_scores,
-    }
-    return json.dumps(data), 200
+    body, etag = leaderboard.view_json()
+    response = make_response(body, 200)
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = setup.HIGH_SCORE_MAX_AGE
+    return response.make_conditional(request)
 
 
-@app.route("/auth", methods=["POST"])
+@bp.route("/highScoreStream")
+def high_score_stream():
+    """
+        Stream high score updates as Server-Sent Events. The first event
+        contains both lists, later events only the lists that changed.
+        Changes made by other workers are picked up while waiting.
+    """
+    app = current_app._get_current_object()
+    events = leaderboard.events.subscribe()
+    if events is None:
+        # every stream holds a thread, keep the rest for the game
+        response = {"error": "Too many high score streams"}
+        headers = {"Retry-After": str(setup.SSE_HEARTBEAT_INTERVAL)}
+        return json.dumps(response), 503, headers
+
+    data = leaderboard.view()
+    # events published before the view above are already included in it
+    while not events.empty():
+        events.get_nowait()
+
+    def stream():
+        try:
+            yield "event: highscore\ndata: " + json.dumps(data) + "\n\n"
+            while True:
+                try:
+                    delta = events.get(timeout=setup.SSE_HEARTBEAT_INTERVAL)
+                except queue.Empty:
+                    # checks for changes by other workers and publishes them
+                    with app.app_context():
+                        leaderboard.view()
+                    yield ": keepalive\n\n"
+                    continue
+
+                if delta == RESYNC:
+                    # events were dropped, send both lists instead
+                    with app.app_context():
+                        delta = leaderboard.view()
+
+                yield "event: highscore\ndata: " + json.dumps(delta) + "\n\n"
+        finally:
+            leaderboard.events.unsubscribe(events)
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return Response(stream(), mimetype="text/event-stream", headers=headers)
+
+
+@bp.route("/auth", methods=["POST"])
 def authenticate():
     """
         Endpoint for admin authentication. Returns encrypted cookie with login
@@ -212,7 +308,7 @@ def authenticate():
     return json.dumps({"success": "OK"}), 200
 
 
-@app.route("/admin/<action>", methods=["POST"])
+@bp.route("/admin/<action>", methods=["POST"])
 def admin_page(action):
     """
         Endpoint for admin actions. Requires authentication from /auth within
@@ -222,32 +318,49 @@ def admin_page(action):
     is_authenticated()
 
     if action == "clearHighScore":
-        models.clear_highscores()
+        leaderboard.clear()
         return json.dumps({"success": "High scores cleared"}), 200
 
-    elif action == "trainML":
-        # Run training asynchronously
-        Thread(target=classifier.retrain).start()
-        return json.dumps({"success": "Training started"}), 200
-
-    elif action == "hardReset":
-        # Delete all images in CV, upload all orignal images and retrain
-        classifier.delete_all_images()
-        storage.clear_dataset()
-        Thread(target=classifier.hard_reset_retrain).start()
-        response = {"success": "All images deleted, nodel now training"}
+    elif action in ("trainML", "hardReset"):
+        # trainML uploads new images and retrains, hardReset deletes all
+        # images in CV, uploads all orignal images and retrains
+        job_id = job_manager.submit(
+            current_app._get_current_object(), get_classifier(), action
+        )
+        if job_id is None:
+            response = {
+                "error": "Another job is running",
+                "job": job_manager.status(),
+            }
+            return json.dumps(response), 409
+
+        response = {"success": "Job started", "job_id": job_id}
         return json.dumps(response), 200
 
     elif action == "status":
         new_blob_image_count = storage.image_count()
+        classifier = get_classifier()
         iteration = classifier.get_iteration()
         data = {
             "CV_iteration_name": iteration.name,
             "CV_time_created": str(iteration.created),
             "BLOB_image_count": new_blob_image_count,
+            "CV_prediction_cache": classifier.prediction_cache.stats(),
+            "BLOB_upload_queue": storage.upload_queue.stats(),
+            "JOB": job_manager.status(),
         }
         return json.dumps(data), 200
 
+    elif action == "dbPool":
+        pool = models.db.engine.pool
+        data = pool.stats() if hasattr(pool, "stats") else pool.status()
+        return json.dumps(data), 200
+
+    elif action == "reloadLabels":
+        version = models.invalidate_labels()
+        response = {"success": "Labels reloaded", "version": version}
+        return json.dumps(response), 200
+
     elif action == "logout":
         session.clear()
         return json.dumps({"success": "Session cleared"}), 200
@@ -259,7 +372,7 @@ def admin_page(action):
         return json.dumps({"error": "Admin action unspecified"}), 400
 
 
-@app.errorhandler(Exception)
+@bp.app_errorhandler(Exception)
 def handle_exception(error):
     """
        Captures all exceptions raised. If the Exception is a HTTPException the
@@ -271,28 +384,50 @@ def handle_exception(error):
         if error.code >= 400 and error.code < 500:
             return error
     else:
-        app.logger.error(error)
+        current_app.logger.error(error)
         return json.dumps({"error": "Internal server error"}), 500
 
 
 def allowed_file(image):
     """
-        Check if image satisfies the constraints of Custom Vision.
+        Check if image satisfies the constraints of Custom Vision. Requests
+        larger than MAX_CONTENT_LENGTH are rejected by Flask before the body
+        is parsed, so only the image itself is checked against the maximum
+        size here. The resolution is read from the PNG header without
+        decoding the image.
+
+        Returns the image as bytes, to be shared by the classifier and
+        storage.
     """
     if image.filename == "":
         raise excp.BadRequest("No image submitted")
 
     # Check that the file is a png
-    is_png = image.content_type == "image/png"
+    if image.content_type != "image/png":
+        raise excp.UnsupportedMediaType("Wrong image format")
+
     # Ensure the file isn't too large
-    too_large = len(image.read()) > setup.MAX_IMAGE_SIZE
+    chunks = []
+    size = 0
+    while True:
+        chunk = image.stream.read(setup.UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+
+        size += len(chunk)
+        if size > setup.MAX_IMAGE_SIZE:
+            raise excp.UnsupportedMediaType("Wrong image format")
+
+        chunks.append(chunk)
+
+    data = b"".join(chunks)
     # Ensure the file has correct resolution
-    height, width = get_image_resolution(image)
+    width, height = get_image_resolution(data)
     MIN_RES = setup.MIN_RESOLUTION
-    correct_res = (height >= MIN_RES) and (width >= MIN_RES)
-    if not is_png or too_large or not correct_res:
+    if width < MIN_RES or height < MIN_RES:
         raise excp.UnsupportedMediaType("Wrong image format")
-    image.seek(0)
+
+    return data
 
 
 def add_user():
@@ -333,12 +468,14 @@ def is_authenticated():
 
 def white_image(image):
     """
-        Check if the image provided is completely white.
+        Check if the image provided is blank or nearly blank. The image is
+        downscaled and only pixels darker than BLANK_PIXEL_THRESHOLD count as
+        drawn, which ignores antialiasing noise and stray pixels.
     """
-    if not ImageChops.invert(image).getbbox():
-        return True
-    else:
-        return False
+    size = (setup.BLANK_IMAGE_SIZE, setup.BLANK_IMAGE_SIZE)
+    histogram = grayscale(image).resize(size, Image.BOX).histogram()
+    drawn_pixels = sum(histogram[: setup.BLANK_PIXEL_THRESHOLD])
+    return drawn_pixels <= setup.BLANK_MAX_DRAWN_PIXELS
 
 
 def white_image_data(label, time_left, game_id, player_id):
@@ -349,7 +486,7 @@ def white_image_data(label, time_left, game_id, player_id):
     if time_left > 0:
         game_state = "Playing"
     else:
-        models.update_game_for_player(game_id, player_id, 1, "Done")
+        session_store.advance(game_id, player_id, "Done")
         game_state = "Done"
 
     data = {
@@ -362,11 +499,21 @@ def white_image_data(label, time_left, game_id, player_id):
     return json.dumps(data), 200
 
 
-def get_image_resolution(image):
+def get_image_resolution(data):
     """
-        Retrieve the resolution of the image provided.
+        Retrieve the resolution of the png image provided as bytes, read from
+        the IHDR chunk in the file header.
     """
-    image.seek(0)
-    height, width = Image.open(BytesIO(image.stream.read())).size
-    image.seek(0)
-    return height, width
+    if (
+        len(data) < 24
+        or data[:8] != PNG_SIGNATURE
+        or data[12:16] != b"IHDR"
+    ):
+        raise excp.UnsupportedMediaType("Wrong image format")
+
+    width, height = struct.unpack(">II", data[16:24])
+    return width, height
+
+
+# Initialization app, served by gunicorn as webapp.api:app
+app = create_app()
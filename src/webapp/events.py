@@ -0,0 +1,84 @@
+"""
+    In-process publish/subscribe used to push updates to streaming clients.
+"""
+import queue
+import threading
+
+# Event replacing the queued events of a subscriber that fell behind, the
+# subscriber has to fetch the full state instead
+RESYNC = "resync"
+
+
+class EventBroker:
+    """
+        Fans out published events to the queues of all subscribers in this
+        process. Subscribers that don't keep up lose their queued events
+        instead of blocking the publisher, and receive RESYNC instead. At
+        most max_subscribers queues are handed out at a time.
+    """
+
+    def __init__(self, max_queue_size, max_subscribers=None):
+        self.max_queue_size = max_queue_size
+        self.max_subscribers = max_subscribers
+        self.__subscribers = set()
+        self.__lock = threading.Lock()
+
+    def subscribe(self):
+        """
+            Returns a new queue receiving all events published from now on,
+            or None if there are already max_subscribers subscribers.
+        """
+        subscriber = queue.Queue(maxsize=self.max_queue_size)
+        with self.__lock:
+            if (
+                self.max_subscribers is not None
+                and len(self.__subscribers) >= self.max_subscribers
+            ):
+                return None
+
+            self.__subscribers.add(subscriber)
+
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        """
+            Stops sending events to the queue.
+        """
+        with self.__lock:
+            self.__subscribers.discard(subscriber)
+
+    def publish(self, event):
+        """
+            Sends the event to every subscriber.
+        """
+        with self.__lock:
+            subscribers = list(self.__subscribers)
+
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(event)
+            except queue.Full:
+                self.__resync(subscriber)
+
+    def __resync(self, subscriber):
+        """
+            Replaces the queued events of the subscriber with RESYNC.
+        """
+        try:
+            while True:
+                subscriber.get_nowait()
+        except queue.Empty:
+            pass
+
+        try:
+            subscriber.put_nowait(RESYNC)
+        except queue.Full:
+            # filled again by a concurrent publish, which resyncs as well
+            pass
+
+    def count(self):
+        """
+            Returns the number of subscribers.
+        """
+        with self.__lock:
+            return len(self.__subscribers)
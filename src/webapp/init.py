@@ -0,0 +1,61 @@
+"""
+    Initializes the database of a deployment: creates missing tables and
+    indexes, seeds the labels, migrates the image count and stores the
+    latest published Custom Vision iteration. Run once before the gunicorn
+    workers are started, instead of in every worker.
+
+    Example, run from src/:
+    python -m webapp.init
+"""
+import argparse
+from webapp import api
+from webapp import models
+from webapp import storage
+from customvision.classifier import Classifier
+
+# Labels with their norwegian translation, seeded into the Labels table
+LABELS_PATH = "./dict_eng_to_nor.csv"
+
+parser = argparse.ArgumentParser(
+    description="create tables, seed labels and store the CV iteration"
+)
+parser.add_argument(
+    "--labels",
+    type=str,
+    default=LABELS_PATH,
+    help="csv file with english and norwegian labels",
+)
+parser.add_argument(
+    "--skip-iteration",
+    action="store_true",
+    help="do not look up the latest published iteration in Custom Vision",
+)
+
+
+def init(labels_path=LABELS_PATH, sync_iteration=True):
+    """
+        Creates the tables, seeds the labels, migrates the image count and,
+        if sync_iteration is set, stores the latest published iteration name
+        in the database.
+    """
+    models.create_tables(api.app)
+    seeded = models.seed_labels(api.app, labels_path)
+    print(f"Tables created, {seeded} labels inserted or updated")
+    with api.app.app_context():
+        count = storage.migrate_image_count()
+    print(f"{count} new images in blob storage")
+    if sync_iteration:
+        iteration_name = Classifier().sync_iteration_name()
+        print(f"Using iteration {iteration_name}")
+
+
+def main():
+    """
+        Main function of the script.
+    """
+    args = parser.parse_args()
+    init(args.labels, not args.skip_iteration)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+    Periodic cleanup of expired games. Runs in a background thread in each
+    worker, so the cleanup is kept out of the request path. A lease in the
+    JobLocks table makes only one worker of the deployment do the cleanup,
+    another worker takes over if it stops renewing the lease.
+"""
+import os
+import time
+import uuid
+import threading
+from webapp import models
+from utilities import setup
+
+# Name of the lease in the JobLocks table
+LEASE_NAME = "janitor"
+
+janitor_pid = None
+janitor_lock = threading.Lock()
+
+
+def start(app):
+    """
+        Starts the janitor thread once per process. The check on the pid
+        starts a new thread in processes forked after the first start.
+    """
+    global janitor_pid
+    if janitor_pid == os.getpid():
+        return
+
+    with janitor_lock:
+        if janitor_pid != os.getpid():
+            janitor_pid = os.getpid()
+            threading.Thread(target=run, args=(app,), daemon=True).start()
+
+
+def has_lease(janitor_id):
+    """
+        Renews the lease if janitor_id holds it, else takes it if it is free
+        or was not renewed for two intervals. Returns True if janitor_id
+        holds the lease. Must be called within an app context.
+    """
+    if models.renew_job_lock(LEASE_NAME, janitor_id):
+        return True
+
+    stale_after = 2 * setup.JANITOR_INTERVAL
+    return models.acquire_job_lock(
+        LEASE_NAME, None, janitor_id, stale_after
+    )
+
+
+def run(app):
+    """
+        Deletes expired games every JANITOR_INTERVAL seconds, if this worker
+        holds the lease.
+    """
+    janitor_id = str(uuid.uuid4())
+    while True:
+        time.sleep(setup.JANITOR_INTERVAL)
+        try:
+            with app.app_context():
+                if not has_lease(janitor_id):
+                    continue
+
+                deleted = models.delete_old_games(setup.JANITOR_BATCH_SIZE)
+            if deleted > 0:
+                app.logger.info(f"Janitor deleted {deleted} old games")
+        except Exception as e:
+            app.logger.error(e)
@@ -0,0 +1,285 @@
+"""
+    Background jobs started from the admin page, like training of the ML
+    model. A job runs in a thread of the worker that received the request,
+    while a lock in the database makes sure only one job runs across all
+    workers. The step and progress of the job are stored in the database,
+    so they can be shown by /admin/status, and another worker resumes the
+    job from its last step if the worker running it is recycled.
+"""
+import os
+import time
+import uuid
+import threading
+from azure.cognitiveservices.vision.customvision.training.models import (
+    CustomVisionErrorException,
+)
+from webapp import models
+from webapp import storage
+from utilities import setup
+
+# Steps of each kind of job. A resumed job restarts at its last step.
+STEPS = {
+    "trainML": ["upload", "train"],
+    "hardReset": ["delete", "wait_for_deletion", "upload", "train"],
+}
+
+# Error code of Custom Vision when no images changed since the last training
+TRAINING_NOT_NEEDED = "BadRequestTrainingNotNeeded"
+
+# Container with the images uploaded by each kind of job
+CONTAINERS = {
+    "trainML": setup.CONTAINER_NAME_NEW,
+    "hardReset": setup.CONTAINER_NAME_ORIGINAL,
+}
+
+
+class JobLost(Exception):
+    """
+        Raised in a job when its lock has been taken over by another worker.
+    """
+
+
+class JobManager:
+    """
+        Runs jobs one at a time across all workers. The worker running a
+        job renews the heartbeat of the lock every heartbeat_interval
+        seconds. Every worker checks every watch_interval seconds for a job
+        whose heartbeat is older than stale_after seconds and takes it over.
+    """
+
+    def __init__(
+        self, lock_name, heartbeat_interval, stale_after, watch_interval
+    ):
+        self.lock_name = lock_name
+        self.heartbeat_interval = heartbeat_interval
+        self.stale_after = stale_after
+        self.watch_interval = watch_interval
+        self.__lock = threading.Lock()
+        self.__pid = None
+        self.__progress = {}
+        self.__lost = set()
+
+    def submit(self, app, classifier, kind):
+        """
+            Starts a job of the given kind. Returns the id of the job, or
+            None if another job is running.
+        """
+        job_id = str(uuid.uuid4())
+        owner = str(uuid.uuid4())
+        with app.app_context():
+            if not models.acquire_job_lock(
+                self.lock_name, job_id, owner, self.stale_after
+            ):
+                return None
+
+            models.insert_into_jobs(job_id, kind)
+
+        self.__start_job(app, classifier, job_id, owner)
+        return job_id
+
+    def status(self):
+        """
+            Returns the state and progress of the latest job, or None if no
+            job has been started. Must be called within an app context.
+        """
+        job = models.get_latest_job()
+        if job is None:
+            return None
+
+        return {
+            "job_id": job.job_id,
+            "kind": job.kind,
+            "state": job.state,
+            "step": job.step,
+            "progress": job.progress,
+            "created": str(job.created),
+            "updated": str(job.updated),
+        }
+
+    def start(self, app, classifier):
+        """
+            Starts the thread resuming stale jobs once per process. The check
+            on the pid starts a new thread in processes forked after the
+            first start.
+        """
+        if self.__pid == os.getpid():
+            return
+
+        with self.__lock:
+            if self.__pid != os.getpid():
+                self.__pid = os.getpid()
+                self.__progress = {}
+                self.__lost = set()
+                threading.Thread(
+                    target=self.__watch, args=(app, classifier), daemon=True
+                ).start()
+
+    def resume(self, app, classifier):
+        """
+            Takes over the running job if its worker stopped renewing the
+            lock. Returns the id of the resumed job, or None.
+        """
+        with app.app_context():
+            lock = models.get_job_lock(self.lock_name)
+            if lock is None or lock.job_id is None:
+                return None
+
+            job = models.get_job(lock.job_id)
+            if job is None or job.state != "running":
+                return None
+
+            job_id = job.job_id
+            step = job.step
+            owner = str(uuid.uuid4())
+            if not models.acquire_job_lock(
+                self.lock_name, job_id, owner, self.stale_after
+            ):
+                return None
+
+        app.logger.info(f"Resuming job {job_id} at step {step}")
+        self.__start_job(app, classifier, job_id, owner)
+        return job_id
+
+    def __watch(self, app, classifier):
+        """
+            Checks for stale jobs every watch_interval seconds.
+        """
+        while True:
+            time.sleep(self.watch_interval)
+            try:
+                self.resume(app, classifier)
+            except Exception as e:
+                app.logger.error(e)
+
+    def __start_job(self, app, classifier, job_id, owner):
+        """
+            Runs the job and its heartbeat in background threads. The run
+            holds the lock as owner.
+        """
+        stop = threading.Event()
+        threading.Thread(
+            target=self.__heartbeat, args=(app, job_id, owner, stop),
+            daemon=True,
+        ).start()
+        threading.Thread(
+            target=self.__run, args=(app, classifier, job_id, owner, stop),
+            daemon=True,
+        ).start()
+
+    def __heartbeat(self, app, job_id, owner, stop):
+        """
+            Renews the lock and stores the latest progress of the job until
+            stop is set.
+        """
+        while not stop.wait(self.heartbeat_interval):
+            try:
+                with app.app_context():
+                    if not models.renew_job_lock(self.lock_name, owner):
+                        self.__lost.add(owner)
+                        return
+
+                    message = self.__progress.get(owner)
+                    if message is not None:
+                        models.update_job(job_id, progress=message[:256])
+            except Exception as e:
+                app.logger.error(e)
+
+    def __run(self, app, classifier, job_id, owner, stop):
+        """
+            Runs the steps of the job, starting at the last started step,
+            and releases the lock when the job is done.
+        """
+
+        def progress(message):
+            if owner in self.__lost:
+                raise JobLost(f"Job {job_id} was taken over")
+
+            self.__progress[owner] = message
+
+        state = "completed"
+        message = "Done"
+        step = None
+        try:
+            with app.app_context():
+                job = models.get_job(job_id)
+                kind = job.kind
+                steps = STEPS[kind]
+                first = steps.index(job.step) if job.step in steps else 0
+                iteration_id = job.iteration_id
+
+            for step in steps[first:]:
+                progress(f"Starting {step}")
+                with app.app_context():
+                    models.update_job(job_id, step=step)
+
+                self.__run_step(
+                    app, classifier, job_id, kind, step, iteration_id,
+                    progress,
+                )
+        except JobLost as e:
+            app.logger.error(e)
+            return
+        except CustomVisionErrorException as e:
+            app.logger.error(e)
+            state = "failed"
+            message = str(e)
+            code = getattr(getattr(e, "error", None), "code", None)
+            if step == "train" and code == TRAINING_NOT_NEEDED:
+                message = "No changes since last training"
+        except Exception as e:
+            app.logger.error(e)
+            state = "failed"
+            message = str(e)
+        finally:
+            stop.set()
+            self.__progress.pop(owner, None)
+
+        if owner in self.__lost:
+            return
+
+        with app.app_context():
+            models.update_job(job_id, state=state, progress=message[:256])
+            models.release_job_lock(self.lock_name, owner)
+
+    def __run_step(
+        self, app, classifier, job_id, kind, step, iteration_id, progress
+    ):
+        """
+            Runs a single step of a job.
+        """
+        if step == "delete":
+            classifier.delete_all_images()
+            with app.app_context():
+                storage.clear_dataset()
+
+        elif step == "wait_for_deletion":
+            classifier.wait_for_deletion(progress)
+
+        elif step == "upload":
+            with app.app_context():
+                labels = models.get_all_labels()
+
+            classifier.upload_images(labels, CONTAINERS[kind], progress)
+
+        elif step == "train":
+            # a resumed job keeps waiting for the iteration it started, also
+            # when the worker died before the iteration could be recorded
+            if iteration_id is None:
+                iteration = classifier.training_iteration()
+                if iteration is None:
+                    iteration = classifier.start_training()
+
+                iteration_id = iteration.id
+                with app.app_context():
+                    models.update_job(job_id, iteration_id=iteration_id)
+
+            iteration = classifier.wait_for_training(iteration_id, progress)
+            classifier.publish(iteration)
+
+
+job_manager = JobManager(
+    "training",
+    setup.JOB_HEARTBEAT_INTERVAL,
+    setup.JOB_STALE_AFTER,
+    setup.JOB_WATCH_INTERVAL,
+)
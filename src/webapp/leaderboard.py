@@ -0,0 +1,197 @@
+"""
+    In-memory leaderboard serving the high score lists without reading the
+    Scores table on every request.
+"""
+import json
+import time
+import heapq
+import hashlib
+import datetime
+import itertools
+import threading
+from webapp import models
+from webapp.events import EventBroker
+from utilities import setup
+
+# Name of the database counter that is increased on every change
+VERSION_COUNTER = "leaderboard_version"
+
+
+class Leaderboard:
+    """
+        Keeps the all time and daily top n scores in min-heaps. Scores
+        inserted through this worker are added incrementally. Changes made
+        by other workers are detected through a version counter in the
+        database, checked at most every sync_interval seconds, which reloads
+        the lists. The daily list is rolled over at midnight. Every change
+        is published to subscribers of events with the lists that changed.
+    """
+
+    def __init__(self, top_n, sync_interval):
+        self.top_n = top_n
+        self.sync_interval = sync_interval
+        self.__lock = threading.RLock()
+        self.__sequence = itertools.count()
+        self.__total = []
+        self.__daily = []
+        self.__day = None
+        self.__version = None
+        self.__checked = 0.0
+        self.__response = None
+        self.__published = {}
+        self.events = EventBroker(setup.SSE_QUEUE_SIZE, setup.SSE_MAX_STREAMS)
+
+    def view(self):
+        """
+            Returns the daily and all time high score lists, sorted by score
+            descending. Must be called within an app context.
+        """
+        with self.__lock:
+            self.__sync()
+            return {
+                "daily": self.__sorted(self.__daily),
+                "total": self.__sorted(self.__total),
+            }
+
+    def view_json(self):
+        """
+            Returns the lists from view() serialized as json, together with
+            an ETag computed from the content. Both are cached until the
+            leaderboard changes, and the ETag is the same in every worker
+            with the same scores. Must be called within an app context.
+        """
+        with self.__lock:
+            self.__sync()
+            if self.__response is None:
+                body = json.dumps(self.view())
+                etag = hashlib.md5(body.encode("utf-8")).hexdigest()
+                self.__response = (body, etag)
+
+            return self.__response
+
+    def insert(self, name, score, date):
+        """
+            Inserts the score into the Scores table and the leaderboard.
+        """
+        models.insert_into_scores(name, score, date)
+        version = self.__bump_version()
+        with self.__lock:
+            self.__push(self.__total, name, score)
+            if date == self.__day:
+                self.__push(self.__daily, name, score)
+
+            self.__response = None
+            self.__set_version(version)
+            self.__publish()
+
+    def clear(self):
+        """
+            Clears the Scores table and the leaderboard.
+        """
+        models.clear_highscores()
+        version = self.__bump_version()
+        with self.__lock:
+            self.__total = []
+            self.__daily = []
+            self.__response = None
+            self.__set_version(version)
+            self.__publish()
+
+    def __bump_version(self):
+        """
+            Increases the version in the database so other workers reload
+            their lists. Returns the version known before the change.
+        """
+        with self.__lock:
+            version = self.__version
+
+        models.increment_counter(VERSION_COUNTER, 1)
+        return version
+
+    def __set_version(self, version):
+        """
+            Marks the lists as up to date with one change on top of version.
+            If other workers changed the scores in the meantime, the version
+            in the database differs and the lists are reloaded on next sync.
+        """
+        if version is not None and version == self.__version:
+            self.__version = version + 1
+
+    def __sync(self):
+        """
+            Reloads the lists if the version in the database has changed or
+            the day has changed. The version is only read once per
+            sync_interval.
+        """
+        now = time.monotonic()
+        today = datetime.date.today()
+        is_fresh = now - self.__checked < self.sync_interval
+        if self.__version is not None and is_fresh and self.__day == today:
+            return
+
+        version = models.get_counter(VERSION_COUNTER) or 0
+        if version != self.__version or self.__day != today:
+            self.__total = self.__heap(
+                models.get_top_n_high_score_list(self.top_n)
+            )
+            self.__daily = self.__heap(
+                models.get_daily_high_score(self.top_n)
+            )
+            self.__day = today
+            self.__version = version
+            self.__response = None
+            self.__publish()
+
+        self.__checked = now
+
+    def __publish(self):
+        """
+            Publishes the lists that changed since the last published event.
+        """
+        current = {
+            "daily": self.__sorted(self.__daily),
+            "total": self.__sorted(self.__total),
+        }
+        delta = dict(
+            [
+                (key, value)
+                for key, value in current.items()
+                if self.__published.get(key) != value
+            ]
+        )
+        self.__published = current
+        if delta:
+            self.events.publish(delta)
+
+    def __heap(self, high_scores):
+        """
+            Builds a heap from a list of high score dictionaries.
+        """
+        heap = []
+        for player in high_scores:
+            self.__push(heap, player["name"], player["score"])
+
+        return heap
+
+    def __push(self, heap, name, score):
+        """
+            Adds the score to the heap, keeping only the top n scores.
+        """
+        # the Scores table stores scores as integers
+        entry = (int(score), next(self.__sequence), name)
+        if len(heap) < self.top_n:
+            heapq.heappush(heap, entry)
+        elif entry > heap[0]:
+            heapq.heapreplace(heap, entry)
+
+    def __sorted(self, heap):
+        """
+            Returns the heap as a list of dictionaries sorted by score.
+        """
+        return [
+            {"name": name, "score": score}
+            for score, sequence, name in sorted(heap, reverse=True)
+        ]
+
+
+leaderboard = Leaderboard(setup.TOP_N, setup.LEADERBOARD_SYNC_INTERVAL)
@@ -0,0 +1,109 @@
+"""
+    In-process key-value store with the subset of the redis-py interface used
+    by the session store. Used instead of Redis when the game runs in a
+    single worker, and in tests.
+"""
+import time
+import threading
+
+
+class MemoryStore:
+    """
+        Thread safe dictionary with expiring keys, like get, set and delete
+        in redis-py. Expired keys are removed when they are read, and all
+        expired keys are removed every purge_interval writes.
+    """
+
+    def __init__(self, purge_interval=1000):
+        self.purge_interval = purge_interval
+        self.__entries = {}
+        self.__writes = 0
+        self.__lock = threading.RLock()
+
+    def get(self, key):
+        """
+            Returns the value of key, or None if it is missing or expired.
+        """
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is None:
+                return None
+
+            value, expires = entry
+            if expires is not None and expires <= time.monotonic():
+                del self.__entries[key]
+                return None
+
+            return value
+
+    def set(self, key, value, ex=None):
+        """
+            Sets key to value, expiring after ex seconds if given.
+        """
+        expires = None if ex is None else time.monotonic() + ex
+        with self.__lock:
+            self.__entries[key] = (value, expires)
+            self.__writes += 1
+            if self.__writes % self.purge_interval == 0:
+                self.__purge()
+
+        return True
+
+    def delete(self, *keys):
+        """
+            Deletes the keys. Returns the number of keys that existed.
+        """
+        with self.__lock:
+            return len(
+                [key for key in keys if self.__entries.pop(key, None)]
+            )
+
+    def transaction(self, func, *watches, value_from_callable=False):
+        """
+            Calls func with a pipeline while holding the lock of the store,
+            like transaction in redis-py. Reads and writes of func are
+            therefore atomic. Returns the return value of func if
+            value_from_callable is set, else the results of the writes.
+        """
+        with self.__lock:
+            pipe = MemoryPipeline(self)
+            value = func(pipe)
+            return value if value_from_callable else pipe.results
+
+    def __purge(self):
+        """
+            Removes all expired keys.
+        """
+        now = time.monotonic()
+        expired = [
+            key
+            for key, (value, expires) in self.__entries.items()
+            if expires is not None and expires <= now
+        ]
+        for key in expired:
+            del self.__entries[key]
+
+
+class MemoryPipeline:
+    """
+        Pipeline passed to the function of MemoryStore.transaction. Commands
+        run immediately, as the store is locked during the transaction.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.results = []
+
+    def multi(self):
+        """
+            Starts the writes of the transaction, nothing to do here.
+        """
+
+    def get(self, key):
+        return self.store.get(key)
+
+    def set(self, key, value, ex=None):
+        self.results.append(self.store.set(key, value, ex=ex))
+
+    def delete(self, *keys):
+        self.results.append(self.store.delete(*keys))
@@ -4,11 +4,16 @@
 """
 
 import datetime
+import json
 import csv
 import os
 import random
+import threading
+import time
+import sqlalchemy
 from flask_sqlalchemy import SQLAlchemy
 from werkzeug import exceptions as excp
+from utilities import setup
 
 db = SQLAlchemy()
 
@@ -30,6 +35,7 @@ class Games(db.Model):
 
     game_id = db.Column(db.NVARCHAR(32), primary_key=True)
     session_num = db.Column(db.Integer, default=1)
+    # json list of labels, only used by games created before GameLabels
     labels = db.Column(db.String(64))
     date = db.Column(db.DateTime)
 
@@ -40,6 +46,24 @@ class Games(db.Model):
         "MulitPlayer", uselist=False, back_populates="game",
         cascade="all, delete"
     )
+    # also tells the unit of work to insert games before their labels
+    labels_rows = db.relationship(
+        "GameLabels", order_by="GameLabels.position",
+        cascade="all, delete-orphan"
+    )
+
+
+class GameLabels(db.Model):
+    """
+        The labels of a game, one row per session. position is the
+        session_num the label is drawn in, starting at 1.
+    """
+
+    game_id = db.Column(
+        db.NVARCHAR(32), db.ForeignKey("games.game_id"), primary_key=True
+    )
+    position = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    label = db.Column(db.String(32), nullable=False)
 
 
 class Scores(db.Model):
@@ -53,6 +77,12 @@ class Scores(db.Model):
     score = db.Column(db.Integer, nullable=False)
     date = db.Column(db.Date)
 
+    # indexes for the daily and all time high score lists
+    __table_args__ = (
+        db.Index("ix_scores_date_score", "date", "score"),
+        db.Index("ix_scores_score", "score"),
+    )
+
 
 class Players(db.Model):
     """
@@ -93,6 +123,50 @@ class Labels(db.Model):
     norwegian = db.Column(db.String(32))
 
 
+class Counters(db.Model):
+    """
+        Named counters shared by all workers, e.g. the number of images in
+        the new image container. Values are updated atomically in the
+        database.
+    """
+
+    name = db.Column(db.String(32), primary_key=True)
+    value = db.Column(db.Integer, nullable=False, default=0)
+
+
+class Jobs(db.Model):
+    """
+        Background jobs started from the admin page, e.g. training of the ML
+        model. step is the last started step of the job and iteration_id the
+        Custom Vision iteration being trained, which lets another worker
+        resume the job if its worker is recycled.
+    """
+
+    job_id = db.Column(db.String(36), primary_key=True)
+    kind = db.Column(db.String(32), nullable=False)
+    state = db.Column(db.String(16), nullable=False)
+    step = db.Column(db.String(32))
+    progress = db.Column(db.String(256))
+    iteration_id = db.Column(db.String(36))
+    created = db.Column(db.DateTime)
+    updated = db.Column(db.DateTime)
+
+
+class JobLocks(db.Model):
+    """
+        Locks making sure only one job of a kind runs across all workers.
+        The worker running the job renews the heartbeat, a lock with a stale
+        heartbeat can be taken over. The owner is a token of the run holding
+        the lock, so a run taking over a job does not share it with the run
+        it took over.
+    """
+
+    name = db.Column(db.String(32), primary_key=True)
+    job_id = db.Column(db.String(36))
+    owner = db.Column(db.String(36))
+    heartbeat = db.Column(db.DateTime)
+
+
 class User(db.Model):
     """
         This is user model in the database to store username and psw for
@@ -102,6 +176,99 @@ class User(db.Model):
     password = db.Column(db.String(256))
 
 
+class GameSession:
+    """
+        Snapshot of the state of a player in a game. It is not attached to
+        the database session, so it can be used after the session is
+        closed and is cheap to create. label is the label of the current
+        session, or None when all sessions are done.
+    """
+
+    __slots__ = (
+        "player_id", "game_id", "state", "session_num", "label", "date"
+    )
+
+    def __init__(self, player_id, game_id, state, session_num, label, date):
+        self.player_id = player_id
+        self.game_id = game_id
+        self.state = state
+        self.session_num = session_num
+        self.label = label
+        self.date = date
+
+
+# Name of the database counter that is increased on every change of labels
+LABELS_VERSION_COUNTER = "labels_version"
+
+
+class LabelCache:
+    """
+        Process-wide cache of the Labels table. The table is read once per
+        worker and kept in memory. invalidate() increases a version counter
+        in the database, which every worker checks at most every ttl seconds
+        and reloads the labels when it has changed. version is the counter
+        value the cached labels were loaded at.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.version = None
+        self._lock = threading.Lock()
+        self._translation = None
+        self._checked = 0.0
+
+    def translation(self):
+        """
+            Returns the english to norwegian dictionary, loading it from the
+            database on first use and when the version has changed. The
+            dictionary is shared and must not be modified.
+        """
+        translation = self._translation
+        if translation is None or self.__expired():
+            with self._lock:
+                if self._translation is None or self.__expired():
+                    self.__sync()
+                translation = self._translation
+
+        return translation
+
+    def invalidate(self):
+        """
+            Increases the version in the database and drops the cached
+            labels, so every worker reloads them. Returns the new version.
+        """
+        increment_counter(LABELS_VERSION_COUNTER, 1)
+        with self._lock:
+            self._translation = None
+
+        return get_counter(LABELS_VERSION_COUNTER)
+
+    def __expired(self):
+        return time.monotonic() - self._checked > self.ttl
+
+    def __sync(self):
+        """
+            Reloads the labels if they are missing or the version in the
+            database differs from the cached one.
+        """
+        # read the version first, a change after it is seen on next check
+        version = get_counter(LABELS_VERSION_COUNTER) or 0
+        if self._translation is None or version != self.version:
+            labels = Labels.query.all()
+            self._translation = dict(
+                [
+                    (str(label.english), str(label.norwegian))
+                    for label in labels
+                ]
+            )
+            self.version = version
+
+        self._checked = time.monotonic()
+
+
+label_cache = LabelCache(setup.LABEL_CACHE_TTL)
+
+
 # Functions to manipulate the tables above
 def create_tables(app):
     """
@@ -109,13 +276,56 @@ def create_tables(app):
     """
     with app.app_context():
         db.create_all()
+        create_missing_columns()
+        create_missing_indexes()
 
     return True
 
 
+def create_missing_columns():
+    """
+        Adds nullable columns added to models after their tables were
+        created, as create_all() does not alter existing tables.
+    """
+    inspector = sqlalchemy.inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+
+        existing = set(
+            [column["name"] for column in inspector.get_columns(table.name)]
+        )
+        for column in table.columns:
+            if column.name not in existing and column.nullable:
+                column_type = column.type.compile(dialect=db.engine.dialect)
+                with db.engine.begin() as connection:
+                    connection.execute(
+                        sqlalchemy.text(
+                            f"ALTER TABLE {table.name} ADD "
+                            f"{column.name} {column_type}"
+                        )
+                    )
+
+
+def create_missing_indexes():
+    """
+        Creates indexes added to models after their tables were created, as
+        create_all() only creates indexes together with new tables.
+    """
+    inspector = sqlalchemy.inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        existing = set(
+            [index["name"] for index in inspector.get_indexes(table.name)]
+        )
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(bind=db.engine)
+
+
 def insert_into_games(game_id, labels, date):
     """
-        Insert values into Games table.
+        Insert values into Games table. A list of labels is stored in the
+        GameLabels table, a string is stored in the legacy labels column.
 
         Parameters:
         game_id : random uuid.uuid4().hex
@@ -124,24 +334,43 @@ def insert_into_games(game_id, labels, date):
     """
     if (
         isinstance(game_id, str)
-        and isinstance(labels, str)
+        and isinstance(labels, (str, list))
         and isinstance(date, datetime.datetime)
     ):
 
         try:
-            game = Games(game_id=game_id, labels=labels, date=date)
+            if isinstance(labels, str):
+                game = Games(game_id=game_id, labels=labels, date=date)
+            else:
+                game = Games(
+                    game_id=game_id,
+                    date=date,
+                    labels_rows=game_labels(game_id, labels),
+                )
+
             db.session.add(game)
             db.session.commit()
             return True
         except Exception as e:
+            db.session.rollback()
             raise Exception("Could not insert into games :" + str(e))
     else:
         raise excp.BadRequest(
-            "game_id has to be string, labels has to be string "
+            "game_id has to be string, labels has to be list or string "
             "and date has to be datetime.datetime."
         )
 
 
+def game_labels(game_id, labels):
+    """
+        Returns the GameLabels rows for the list of labels of a game.
+    """
+    return [
+        GameLabels(game_id=game_id, position=position, label=label)
+        for position, label in enumerate(labels, start=1)
+    ]
+
+
 def insert_into_scores(name, score, date):
     """
         Insert values into Scores table.
@@ -265,6 +494,44 @@ def get_player(player_id):
     return player_in_game
 
 
+def get_player_with_game(player_id):
+    """
+        Return a GameSession with the player, its game and the label of the
+        current session, loaded with one joined query.
+    """
+    row = (
+        db.session.query(
+            Players.state,
+            Games.game_id,
+            Games.session_num,
+            Games.date,
+            GameLabels.label,
+            Games.labels,
+        )
+        .join(Games, Players.game_id == Games.game_id)
+        .outerjoin(
+            GameLabels,
+            sqlalchemy.and_(
+                GameLabels.game_id == Games.game_id,
+                GameLabels.position == Games.session_num,
+            ),
+        )
+        .filter(Players.player_id == player_id)
+        .first()
+    )
+    if row is None:
+        raise excp.BadRequest("player_id invalid or expired")
+
+    state, game_id, session_num, date, label, legacy_labels = row
+    if label is None and legacy_labels is not None:
+        # games created before GameLabels store the labels as json
+        labels = json.loads(legacy_labels)
+        if session_num <= len(labels):
+            label = labels[session_num - 1]
+
+    return GameSession(player_id, game_id, state, session_num, label, date)
+
+
 def update_game_for_player(game_id, player_id, session_num, state):
     """
         Update game and player_in_game record for the incomming game_id and
@@ -281,17 +548,49 @@ def update_game_for_player(game_id, player_id, session_num, state):
         raise Exception("Could not update game for player: " + str(e))
 
 
+def save_game(game_id, player_id, labels, date, session_num, state):
+    """
+        Insert or update the game, its labels and its player in one
+        transaction. Used to write games kept outside the database when they
+        are finished.
+    """
+    try:
+        db.session.merge(
+            Games(
+                game_id=game_id,
+                session_num=session_num,
+                date=date,
+                labels_rows=game_labels(game_id, labels),
+            )
+        )
+        db.session.merge(
+            Players(player_id=player_id, game_id=game_id, state=state)
+        )
+        db.session.commit()
+        return True
+    except Exception as e:
+        db.session.rollback()
+        raise Exception("Could not save game: " + str(e))
+
+
 def delete_session_from_game(game_id):
     """
         To avoid unecessary data in the database this function is called by
         the api after a session is finished. The record in games table,
-        connected to the particular game_id, is deleted.
+        connected to the particular game_id, is deleted. Raises
+        AttributeError if the game doesn't exist.
     """
+    game = Games.query.get(game_id)
+    if game is None:
+        raise AttributeError("Couldn't find game_id: " + str(game_id))
+
     try:
-        game = Games.query.get(game_id)
         db.session.query(Players).filter(
             Players.game_id == game_id
         ).delete()
+        db.session.query(GameLabels).filter(
+            GameLabels.game_id == game_id
+        ).delete()
         mp = MulitPlayer.query.get(game_id)
         if mp is not None:
             db.session.delete(mp)
@@ -304,47 +603,59 @@ def delete_session_from_game(game_id):
         raise AttributeError("Couldn't find game_id: " + str(e))
 
 
-def delete_old_games():
+def delete_old_games(batch_size):
     """
-        Delete records in games older than one hour.
+        Delete records in games older than one hour, together with their
+        players. Each batch of at most batch_size games is removed with bulk
+        DELETE statements.
+
+        Returns the number of deleted games.
     """
+    cutoff = datetime.datetime.today() - datetime.timedelta(hours=1)
+    deleted = 0
     try:
-        games = (
-            db.session.query(Games)
-            .filter(
-                Games.date
-                < (datetime.datetime.today() - datetime.timedelta(hours=1))
-            )
-            .all()
-        )
-        for game in games:
-            db.session.query(Players).filter(
-                Players.game_id == game.game_id
-            ).delete()
-            db.session.query(MulitPlayer).filter(
-                MulitPlayer.game_id == game.game_id
-            ).delete()
-            db.session.delete(game)
+        while True:
+            game_ids = [
+                game.game_id
+                for game in db.session.query(Games.game_id)
+                .filter(Games.date < cutoff)
+                .limit(batch_size)
+            ]
+            if not game_ids:
+                break
+
+            for model in (Players, MulitPlayer, GameLabels, Games):
+                db.session.query(model).filter(
+                    model.game_id.in_(game_ids)
+                ).delete(synchronize_session=False)
 
-        db.session.commit()
-        return True
+            db.session.commit()
+            deleted += len(game_ids)
+            if len(game_ids) < batch_size:
+                break
+
+        return deleted
     except Exception as e:
         db.session.rollback()
         raise Exception("Couldn't clean up old game records: " + str(e))
 
 
-def get_daily_high_score():
+def get_daily_high_score(top_n=setup.TOP_N):
     """
-        Function for reading all daily scores.
+        Function for reading the top n scores of today.
+
+        Parameter: top_n, number of players in daily top list.
 
         Returns list of dictionaries.
     """
     try:
         today = datetime.date.today()
-        # filter by today and sort by score
+        # filter by today and sort by score, served by ix_scores_date_score
         top_n_list = (
-            Scores.query.filter_by(date=today)
+            db.session.query(Scores.name, Scores.score)
+            .filter(Scores.date == today)
             .order_by(Scores.score.desc())
+            .limit(top_n)
             .all()
         )
         # structure data
@@ -371,7 +682,10 @@ def get_top_n_high_score_list(top_n):
     try:
         # read top n high scores
         top_n_list = (
-            Scores.query.order_by(Scores.score.desc()).limit(top_n).all()
+            db.session.query(Scores.name, Scores.score)
+            .order_by(Scores.score.desc())
+            .limit(top_n)
+            .all()
         )
         # strucutre data
         new = [
@@ -394,6 +708,189 @@ def clear_highscores():
     db.session.commit()
 
 
+def increment_counter(name, n, start=None):
+    """
+        Atomically add n to the counter with the given name. The counter is
+        created if it doesn't exist, starting from the value returned by
+        start() if given, else from 0. start is only called when the counter
+        is created.
+    """
+    try:
+        updated = Counters.query.filter_by(name=name).update(
+            {Counters.value: Counters.value + n}, synchronize_session=False
+        )
+        if updated == 0:
+            value = n if start is None else start() + n
+            db.session.add(Counters(name=name, value=value))
+
+        db.session.commit()
+        return True
+    except Exception as e:
+        db.session.rollback()
+        raise Exception("Could not increment counter: " + str(e))
+
+
+def get_counter(name):
+    """
+        Returns the value of the counter, or None if it doesn't exist.
+    """
+    counter = Counters.query.get(name)
+    return None if counter is None else counter.value
+
+
+def set_counter(name, value):
+    """
+        Sets the counter to value, creating it if it doesn't exist.
+    """
+    try:
+        counter = Counters.query.get(name)
+        if counter is None:
+            db.session.add(Counters(name=name, value=value))
+        else:
+            counter.value = value
+
+        db.session.commit()
+        return True
+    except Exception as e:
+        db.session.rollback()
+        raise Exception("Could not set counter: " + str(e))
+
+
+# Job related functions
+def insert_into_jobs(job_id, kind):
+    """
+        Insert a running job into the Jobs table.
+    """
+    now = datetime.datetime.now()
+    try:
+        job = Jobs(
+            job_id=job_id,
+            kind=kind,
+            state="running",
+            created=now,
+            updated=now,
+        )
+        db.session.add(job)
+        db.session.commit()
+        return True
+    except Exception as e:
+        db.session.rollback()
+        raise Exception("Could not insert into jobs: " + str(e))
+
+
+def update_job(job_id, **values):
+    """
+        Update the columns of the job given as keyword arguments.
+    """
+    values["updated"] = datetime.datetime.now()
+    try:
+        Jobs.query.filter_by(job_id=job_id).update(
+            values, synchronize_session=False
+        )
+        db.session.commit()
+        return True
+    except Exception as e:
+        db.session.rollback()
+        raise Exception("Could not update job: " + str(e))
+
+
+def get_job(job_id):
+    """
+        Returns the job with the given id, or None if it doesn't exist.
+    """
+    return Jobs.query.get(job_id)
+
+
+def get_latest_job():
+    """
+        Returns the most recently created job, or None if there are none.
+    """
+    return Jobs.query.order_by(Jobs.created.desc()).first()
+
+
+def acquire_job_lock(name, job_id, owner, stale_after):
+    """
+        Atomically take the lock with the given name for the run identified
+        by owner, running job_id. The lock is taken if it is free or its
+        heartbeat is older than stale_after seconds. Returns True if the
+        lock was taken.
+    """
+    now = datetime.datetime.now()
+    stale = now - datetime.timedelta(seconds=stale_after)
+    try:
+        updated = JobLocks.query.filter(
+            JobLocks.name == name,
+            sqlalchemy.or_(
+                JobLocks.owner.is_(None), JobLocks.heartbeat < stale
+            ),
+        ).update(
+            {
+                JobLocks.job_id: job_id,
+                JobLocks.owner: owner,
+                JobLocks.heartbeat: now,
+            },
+            synchronize_session=False,
+        )
+        if updated == 0:
+            if JobLocks.query.get(name) is not None:
+                db.session.rollback()
+                return False
+
+            db.session.add(
+                JobLocks(name=name, job_id=job_id, owner=owner, heartbeat=now)
+            )
+
+        db.session.commit()
+        return True
+    except sqlalchemy.exc.IntegrityError:
+        # another worker created the lock at the same time
+        db.session.rollback()
+        return False
+    except Exception as e:
+        db.session.rollback()
+        raise Exception("Could not acquire job lock: " + str(e))
+
+
+def renew_job_lock(name, owner):
+    """
+        Renew the heartbeat of the lock held by owner. Returns False if the
+        lock has been taken over by another run.
+    """
+    try:
+        updated = JobLocks.query.filter_by(name=name, owner=owner).update(
+            {JobLocks.heartbeat: datetime.datetime.now()},
+            synchronize_session=False,
+        )
+        db.session.commit()
+        return updated == 1
+    except Exception as e:
+        db.session.rollback()
+        raise Exception("Could not renew job lock: " + str(e))
+
+
+def release_job_lock(name, owner):
+    """
+        Release the lock if it is held by owner.
+    """
+    try:
+        JobLocks.query.filter_by(name=name, owner=owner).update(
+            {JobLocks.job_id: None, JobLocks.owner: None},
+            synchronize_session=False,
+        )
+        db.session.commit()
+        return True
+    except Exception as e:
+        db.session.rollback()
+        raise Exception("Could not release job lock: " + str(e))
+
+
+def get_job_lock(name):
+    """
+        Returns the lock with the given name, or None if it doesn't exist.
+    """
+    return JobLocks.query.get(name)
+
+
 # User related functions
 def get_user(username):
     """
@@ -405,23 +902,48 @@ def get_user(username):
 
 def seed_labels(app, filepath):
     """
-        Function for updating labels in database.
+        Function for updating labels in database. The labels are upserted in
+        bulk: one query reads the existing labels, then the missing labels
+        are inserted and changed translations updated in one transaction.
     """
+    if not os.path.exists(filepath):
+        raise AttributeError("File path not found")
+
+    with open(filepath) as csvfile:
+        rows = dict(
+            (row[0], row[1]) for row in csv.reader(csvfile, delimiter=",")
+        )
+
     with app.app_context():
-        if os.path.exists(filepath):
-            with open(filepath) as csvfile:
-                try:
-                    readCSV = csv.reader(csvfile, delimiter=",")
-                    for row in readCSV:
-                        # Insert label into Labels table if not present
-                        if Labels.query.get(row[0]) is None:
-                            insert_into_labels(row[0], row[1])
-                except AttributeError as e:
-                    raise AttributeError(
-                        "Could not insert into Labels table: " + str(e)
-                    )
-        else:
-            raise AttributeError("File path not found")
+        try:
+            existing = dict(
+                db.session.query(Labels.english, Labels.norwegian).all()
+            )
+            inserts = [
+                {"english": english, "norwegian": norwegian}
+                for english, norwegian in rows.items()
+                if english not in existing
+            ]
+            updates = [
+                {"english": english, "norwegian": norwegian}
+                for english, norwegian in rows.items()
+                if english in existing and existing[english] != norwegian
+            ]
+            if inserts:
+                db.session.bulk_insert_mappings(Labels, inserts)
+            if updates:
+                db.session.bulk_update_mappings(Labels, updates)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            raise AttributeError(
+                "Could not insert into Labels table: " + str(e)
+            )
+
+        if inserts or updates:
+            label_cache.invalidate()
+
+    return len(inserts) + len(updates)
 
 
 def insert_into_labels(english, norwegian):
@@ -433,6 +955,7 @@ def insert_into_labels(english, norwegian):
             label_row = Labels(english=english, norwegian=norwegian)
             db.session.add(label_row)
             db.session.commit()
+            label_cache.invalidate()
             return True
         except Exception as e:
             raise Exception("Could not insert into Labels table: " + str(e))
@@ -442,12 +965,11 @@ def insert_into_labels(english, norwegian):
 
 def get_n_labels(n):
     """
-        Reads all rows from database and chooses n random labels in a list.
+        Chooses n random labels from the cached labels and returns them in a
+        list.
     """
     try:
-        # read all english labels in database
-        labels = Labels.query.all()
-        english_labels = [str(label.english) for label in labels]
+        english_labels = list(label_cache.translation())
         random_list = random.sample(english_labels, n)
         return random_list
 
@@ -457,12 +979,10 @@ def get_n_labels(n):
 
 def get_all_labels():
     """
-        Reads all labels from database.
+        Returns all english labels.
     """
     try:
-        # read all english labels in database
-        labels = Labels.query.all()
-        return [str(label.english) for label in labels]
+        return list(label_cache.translation())
 
     except Exception as e:
         raise Exception("Could not read Labels table: " + str(e))
@@ -470,14 +990,12 @@ def get_all_labels():
 
 def to_norwegian(english_label):
     """
-        Reads the labels tabel and return the norwegian translation of the
-        english word.
+        Returns the norwegian translation of the english word.
     """
     try:
-        query = Labels.query.get(english_label)
-        return str(query.norwegian)
+        return label_cache.translation()[english_label]
 
-    except AttributeError as e:
+    except KeyError as e:
         raise AttributeError(
             "Could not find translation in Labels table: " + str(e)
         )
@@ -485,10 +1003,18 @@ def to_norwegian(english_label):
 
 def get_translation_dict():
     """
-        Reads all labels from database and create dictionary.
+        Returns the cached dictionary translating english labels into
+        norwegian. The dictionary is shared and must not be modified.
     """
     try:
-        labels = Labels.query.all()
-        return dict([(str(label.english), str(label.norwegian)) for label in labels])
+        return label_cache.translation()
     except Exception as e:
         raise Exception("Could not read Labels table: " + str(e))
+
+
+def invalidate_labels():
+    """
+        Discards the cached labels in every worker, forcing them to be read
+        from the Labels table on next use. Returns the new version.
+    """
+    return label_cache.invalidate()
@@ -0,0 +1,195 @@
+"""
+    Session state of live games. The state of a game is read and updated on
+    every /getLabel and /classify call, so it can be kept in a key-value
+    store instead of the database. The store is selected with
+    setup.SESSION_STORE:
+        sql : Games and Players tables, shared by all workers (default)
+        memory : in-process store, for a single worker
+        redis : Redis server at setup.REDIS_URL, shared by all workers
+"""
+import json
+import datetime
+from webapp import models
+from webapp.models import GameSession
+from utilities import setup
+
+
+class SessionStore:
+    """
+        Interface for session stores.
+    """
+
+    def start(self, game_id, player_id, labels, date):
+        """
+            Stores a new game with the given labels and its player.
+        """
+        raise NotImplementedError
+
+    def get(self, player_id):
+        """
+            Returns the GameSession of the player. Raises BadRequest if the
+            player doesn't exist or the game has expired.
+        """
+        raise NotImplementedError
+
+    def advance(self, game_id, player_id, state):
+        """
+            Moves the game to the next session and sets the state of the
+            player.
+        """
+        raise NotImplementedError
+
+    def finish(self, game_id, player_id):
+        """
+            Deletes the game after the score is saved.
+        """
+        raise NotImplementedError
+
+
+class SqlSessionStore(SessionStore):
+    """
+        Keeps the session state in the Games and Players tables.
+    """
+
+    def start(self, game_id, player_id, labels, date):
+        models.insert_into_games(game_id, labels, date)
+        models.insert_into_players(player_id, game_id, "Playing")
+
+    def get(self, player_id):
+        return models.get_player_with_game(player_id)
+
+    def advance(self, game_id, player_id, state):
+        models.update_game_for_player(game_id, player_id, 1, state)
+
+    def finish(self, game_id, player_id):
+        models.delete_session_from_game(game_id)
+
+
+class KeyValueSessionStore(SessionStore):
+    """
+        Keeps the session state of each player as json under a key that
+        expires after ttl seconds, like games in the database are deleted
+        after an hour. The client is a redis-py client or a MemoryStore.
+        A game is written to the database only when its last session is
+        done, so /endGame still finds it if the key is lost, e.g. when the
+        worker is restarted. Players missing in the store are looked up in
+        the database. advance() updates the state in a transaction, so
+        concurrent calls don't lose updates.
+    """
+
+    def __init__(self, client, ttl):
+        self.client = client
+        self.ttl = ttl
+        self.database = SqlSessionStore()
+
+    def start(self, game_id, player_id, labels, date):
+        data = {
+            "game_id": game_id,
+            "state": "Playing",
+            "session_num": 1,
+            "labels": labels,
+            "date": date.isoformat(),
+        }
+        self.__put(player_id, data)
+
+    def get(self, player_id):
+        data = self.__load(player_id)
+        if data is None:
+            return self.database.get(player_id)
+
+        labels = data["labels"]
+        session_num = data["session_num"]
+        label = None
+        if session_num <= len(labels):
+            label = labels[session_num - 1]
+
+        return GameSession(
+            player_id,
+            data["game_id"],
+            data["state"],
+            session_num,
+            label,
+            datetime.datetime.fromisoformat(data["date"]),
+        )
+
+    def advance(self, game_id, player_id, state):
+        key = self.__key(player_id)
+
+        def update(pipe):
+            # the key is watched, the write fails if it changed meanwhile
+            # and update is called again
+            value = pipe.get(key)
+            if value is None:
+                return None
+
+            data = json.loads(value)
+            data["session_num"] += 1
+            data["state"] = state
+            pipe.multi()
+            pipe.set(key, json.dumps(data), ex=self.ttl)
+            return data
+
+        data = self.client.transaction(update, key, value_from_callable=True)
+        if data is None:
+            # the game is only in the database
+            self.database.advance(game_id, player_id, state)
+            return
+
+        if data["session_num"] > setup.NUM_GAMES:
+            # write behind, the game is saved once when it is finished
+            models.save_game(
+                game_id,
+                player_id,
+                data["labels"],
+                datetime.datetime.fromisoformat(data["date"]),
+                data["session_num"],
+                state,
+            )
+
+    def finish(self, game_id, player_id):
+        self.client.delete(self.__key(player_id))
+        try:
+            self.database.finish(game_id, player_id)
+        except AttributeError:
+            # the game was never written to the database
+            pass
+
+    def __load(self, player_id):
+        """
+            Returns the stored state of the player, or None if it is missing.
+        """
+        value = self.client.get(self.__key(player_id))
+        return None if value is None else json.loads(value)
+
+    def __put(self, player_id, data):
+        """
+            Stores the state of the player.
+        """
+        self.client.set(self.__key(player_id), json.dumps(data), ex=self.ttl)
+
+    def __key(self, player_id):
+        return "session:" + player_id
+
+
+def create_session_store(name):
+    """
+        Returns the session store with the given name, "sql", "memory" or
+        "redis".
+    """
+    if name == "sql":
+        return SqlSessionStore()
+    elif name == "memory":
+        from webapp.memory_store import MemoryStore
+
+        return KeyValueSessionStore(MemoryStore(), setup.SESSION_TTL)
+    elif name == "redis":
+        # redis is optional, only import it when it is used
+        import redis
+
+        client = redis.Redis.from_url(setup.REDIS_URL)
+        return KeyValueSessionStore(client, setup.SESSION_TTL)
+    else:
+        raise ValueError("Unknown session store: " + str(name))
+
+
+session_store = create_session_store(setup.SESSION_STORE)
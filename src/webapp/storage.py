@@ -1,5 +1,6 @@
 """
-    Tools for interacting with Azure blob storage.
+    Tools for interacting with blob storage. The blobs are stored through the
+    backend selected with setup.BLOB_BACKEND.
 """
 import os
 import uuid
@@ -7,16 +8,24 @@ import sys
 import time
 import logging
 from webapp import api
+from webapp import models
+from threading import Lock
 from threading import Thread
-from azure.storage.blob import BlobClient
-from azure.storage.blob import BlobServiceClient
-from utilities.keys import Keys
+from webapp.upload_queue import UploadQueue
+from utilities.blobstore import get_blobstore
+from azure.core.exceptions import ResourceNotFoundError
 from utilities import setup
 
+# Name of the image counter in the database
+IMAGE_COUNTER = "image_count"
+# Increments not yet written to the database
+pending_image_count = 0
+image_count_lock = Lock()
+
 
 def save_image(image, label, certainty):
     """
-        Upload image to blob storage container named "newimgcontainer" with same name as image label.
+        Queue image (bytes or file handle) for upload to blob storage container named "newimgcontainer" with same name as image label.
         Image is renamed to assure unique name. Uploads only if certainty is larger than threshold
         Returns public URL to access image, or non if certainty too low.
     """
@@ -24,31 +33,41 @@ def save_image(image, label, certainty):
     if certainty < setup.SAVE_CERTAINTY:
         return
 
+    if hasattr(image, "read"):
+        image = image.read()
+
     file_name = f"{label}/{uuid.uuid4().hex}.png"
-    connection_string = Keys.get("BLOB_CONNECTION_STRING")
-    base_url = Keys.get("BASE_BLOB_URL")
-    container_name = setup.CONTAINER_NAME_NEW
-    try:
-        blob = BlobClient.from_connection_string(
-            conn_str=connection_string,
-            container_name=container_name,
-            blob_name=file_name,
-        )
-        blob.upload_blob(image)
-        container_client = blob_connection()
-        # update metadata in blob
-        image_count = int(
-            container_client.get_container_properties().metadata["image_count"]
-        )
-        metadata = {"image_count": str(image_count + 1)}
-        container_client.set_container_metadata(metadata=metadata)
-    except Exception as e:
-        api.app.logger.error(e)
-    url = base_url + "/" + container_name + "/" + file_name
+    # the upload is done in the background, outside of the request
+    upload_queue.put(file_name, image)
+    url = get_blobstore().url(setup.CONTAINER_NAME_NEW, file_name)
     logging.info(url)
     return url
 
 
+def upload_image(file_name, image):
+    """
+        Upload image to the new image container. Called by the upload queue.
+    """
+    get_blobstore().upload(setup.CONTAINER_NAME_NEW, file_name, image)
+
+
+def increment_image_count(n):
+    """
+        Add n to the image count. Called by the upload queue once per
+        uploaded batch. The count is kept in the database and incremented
+        atomically, so concurrent workers don't lose updates. Increments
+        that fail are kept and added with the next batch.
+    """
+    global pending_image_count
+    with image_count_lock:
+        pending_image_count += n
+        with api.app.app_context():
+            models.increment_counter(
+                IMAGE_COUNTER, pending_image_count, legacy_image_count
+            )
+        pending_image_count = 0
+
+
 def clear_dataset():
     """
         Method for resetting dataset back to original dataset
@@ -56,11 +75,11 @@ def clear_dataset():
         NOTE: container is deleted by garbage collection, which does not
         happen instantly. A new blob cannot be initalized before old is collected.
     """
-    container_client = blob_connection()
     try:
-        container_client.delete_container()
+        get_blobstore().delete_container(setup.CONTAINER_NAME_NEW)
     except Exception as e:
         raise Exception("could not delete container" + str(e))
+    models.set_counter(IMAGE_COUNTER, 0)
     Thread(target=create_container).start()
 
 
@@ -71,7 +90,6 @@ def create_container():
     """
     tries = setup.CREATE_CONTAINER_TRIES
     waiting_time = setup.CREATE_CONTAINER_WAITER
-    container_client = blob_connection()
     success = False
     metadata = {"image_count": "0"}
     for i in range(tries):
@@ -80,8 +98,8 @@ def create_container():
 
         time.sleep(waiting_time)
         try:
-            container_client.create_container(
-                metadata=metadata, public_access="container"
+            get_blobstore().create_container(
+                setup.CONTAINER_NAME_NEW, metadata
             )
             success = True
         except Exception as e:
@@ -92,26 +110,47 @@ def image_count():
     """
         Returns number of images in 'newimgcontainer'.
     """
-    container_client = blob_connection()
-    return container_client.get_container_properties().metadata["image_count"]
+    count = models.get_counter(IMAGE_COUNTER)
+    if count is None:
+        count = migrate_image_count()
+
+    return count
 
 
-def blob_connection():
+def migrate_image_count():
     """
-        Helper method for connection to blob service.
+        Copies the count from the old container metadata into the database
+        if the counter doesn't exist yet. Called by webapp.init, before any
+        upload can create the counter. Returns the count.
+    """
+    count = models.get_counter(IMAGE_COUNTER)
+    if count is None:
+        count = legacy_image_count()
+        models.set_counter(IMAGE_COUNTER, count)
+
+    return count
+
+
+def legacy_image_count():
+    """
+        Returns the image count kept in the container metadata before it was
+        moved to the database.
     """
-    container_name = setup.CONTAINER_NAME_NEW
-    connect_str = Keys.get("BLOB_CONNECTION_STRING")
     try:
-        # Instantiate a BlobServiceClient using a connection string
-        blob_service_client = BlobServiceClient.from_connection_string(
-            connect_str
-        )
-        # Instantiate a ContainerClient
-        container_client = blob_service_client.get_container_client(
-            container_name
-        )
-    except Exception as e:
-        raise Exception("Could not connect to blob client: " + str(e))
+        metadata = get_blobstore().get_metadata(setup.CONTAINER_NAME_NEW)
+    except ResourceNotFoundError:
+        return 0
+
+    return int(metadata.get("image_count", 0))
+
 
-    return container_client
+upload_queue = UploadQueue(
+    upload_image,
+    increment_image_count,
+    max_size=setup.UPLOAD_QUEUE_SIZE,
+    batch_size=setup.UPLOAD_BATCH_SIZE,
+    retries=setup.UPLOAD_RETRIES,
+    retry_delay=setup.UPLOAD_RETRY_DELAY,
+    flush_interval=setup.UPLOAD_FLUSH_INTERVAL,
+    spill_dir=setup.UPLOAD_SPILL_DIR,
+)
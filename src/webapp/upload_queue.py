@@ -0,0 +1,298 @@
+"""
+    Background queue for uploading images to blob storage outside of the
+    request path.
+"""
+import os
+import queue
+import time
+import atexit
+import logging
+import threading
+from urllib.parse import quote
+from urllib.parse import unquote
+
+# Suffix of spilled files claimed by a process for uploading
+CLAIMED_SUFFIX = ".claimed"
+# Suffix of spilled files being written
+PARTIAL_SUFFIX = ".partial"
+
+
+def pid_alive(pid):
+    """
+        Returns True if a process with the pid is running.
+    """
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # running, but owned by another user
+        return True
+
+    return True
+
+
+class UploadQueue:
+    """
+        Uploads images from a bounded in-memory queue in a background thread.
+        Images are uploaded in batches with retries. When the queue is full,
+        or an image can't be uploaded, it is spilled to disk and uploaded
+        later. Images still queued or being uploaded when the process exits
+        are spilled too. Files claimed by a process that died before
+        uploading them are put back in the spill directory.
+    """
+
+    def __init__(
+        self,
+        upload,
+        on_uploaded,
+        max_size,
+        batch_size,
+        retries,
+        retry_delay,
+        flush_interval,
+        spill_dir,
+    ):
+        """
+            Parameters:
+            upload: function(name, data) uploading a single image
+            on_uploaded: function(n) called after a batch with n uploads
+            max_size: maximum number of images kept in memory
+            batch_size: maximum number of images uploaded per batch
+            retries: number of attempts per image before it is spilled
+            retry_delay: seconds before the first retry, doubled per attempt
+            flush_interval: seconds between checks for spilled images
+            spill_dir: directory for images that don't fit in the queue
+        """
+        self.upload = upload
+        self.on_uploaded = on_uploaded
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.flush_interval = flush_interval
+        self.spill_dir = spill_dir
+        self.uploaded = 0
+        self.failed = 0
+        self.spilled = 0
+        self.last_latency = 0.0
+        self.total_latency = 0.0
+        self.__lock = threading.Lock()
+        self.__pid = None
+        self.__queue = None
+        self.__in_flight = {}
+
+    def put(self, name, data):
+        """
+            Queues data to be uploaded as blob name. Never blocks, the image
+            is spilled to disk if the queue is full.
+        """
+        self.__start()
+        try:
+            self.__queue.put_nowait((name, data))
+        except queue.Full:
+            self.__spill(name, data)
+
+    def stats(self):
+        """
+            Returns queue depth and upload metrics for this process.
+        """
+        depth = 0 if self.__queue is None else self.__queue.qsize()
+        average = self.total_latency / self.uploaded if self.uploaded else 0
+        return {
+            "queue_depth": depth,
+            "spilled_on_disk": len(self.__spilled_files()),
+            "uploaded": self.uploaded,
+            "failed": self.failed,
+            "spilled": self.spilled,
+            "last_upload_latency": round(self.last_latency, 3),
+            "average_upload_latency": round(average, 3),
+        }
+
+    def __start(self):
+        """
+            Starts the worker thread once per process. The check on the pid
+            restarts the worker in processes forked from this one.
+        """
+        if self.__pid == os.getpid():
+            return
+
+        with self.__lock:
+            if self.__pid != os.getpid():
+                self.__queue = queue.Queue(maxsize=self.max_size)
+                threading.Thread(target=self.__run, daemon=True).start()
+                atexit.register(self.__spill_queue)
+                self.__pid = os.getpid()
+
+    def __run(self):
+        """
+            Worker loop, uploads queued images in batches and refills the
+            queue with spilled images when there is room.
+        """
+        while True:
+            self.__load_spilled()
+            try:
+                batch = [self.__queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                continue
+
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.__queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            # kept until uploaded or spilled, so it can be spilled on exit
+            with self.__lock:
+                self.__in_flight.update(batch)
+            self.__upload_batch(batch)
+
+    def __upload_batch(self, batch):
+        """
+            Uploads a batch of images with retries, spilling the images that
+            fail to disk.
+        """
+        uploaded = 0
+        for name, data in batch:
+            if self.__upload_with_retry(name, data):
+                uploaded += 1
+            else:
+                self.failed += 1
+                self.__spill(name, data)
+
+            with self.__lock:
+                self.__in_flight.pop(name, None)
+
+        if uploaded > 0:
+            try:
+                self.on_uploaded(uploaded)
+            except Exception as e:
+                logging.error("Could not update image count: " + str(e))
+
+    def __upload_with_retry(self, name, data):
+        """
+            Uploads a single image, retrying with exponential backoff.
+            Returns True if the upload succeeded.
+        """
+        for attempt in range(self.retries):
+            start = time.monotonic()
+            try:
+                self.upload(name, data)
+            except Exception as e:
+                logging.error(f"Upload of {name} failed: {e}")
+                if attempt + 1 < self.retries:
+                    time.sleep(self.retry_delay * 2 ** attempt)
+                continue
+
+            self.last_latency = time.monotonic() - start
+            self.total_latency += self.last_latency
+            self.uploaded += 1
+            return True
+
+        return False
+
+    def __spill(self, name, data):
+        """
+            Writes the image to the spill directory. The blob name is encoded
+            in the file name.
+        """
+        try:
+            os.makedirs(self.spill_dir, exist_ok=True)
+            path = os.path.join(self.spill_dir, quote(name, safe=""))
+            # write under a partial name first so the file is never read
+            # before it is complete
+            partial = path + "." + str(os.getpid()) + PARTIAL_SUFFIX
+            with open(partial, "wb") as spill_file:
+                spill_file.write(data)
+            os.replace(partial, path)
+            self.spilled += 1
+        except OSError as e:
+            logging.error(f"Could not spill {name} to disk: {e}")
+
+    def __spilled_files(self):
+        """
+            Returns the names of the files waiting in the spill directory.
+        """
+        if not os.path.isdir(self.spill_dir):
+            return []
+
+        return [
+            f for f in os.listdir(self.spill_dir)
+            if not f.endswith((CLAIMED_SUFFIX, PARTIAL_SUFFIX))
+        ]
+
+    def __reclaim_dead(self):
+        """
+            Puts files claimed by processes that are no longer running back
+            in the spill directory, and removes their partial files.
+        """
+        if not os.path.isdir(self.spill_dir):
+            return
+
+        for file_name in os.listdir(self.spill_dir):
+            if not file_name.endswith((CLAIMED_SUFFIX, PARTIAL_SUFFIX)):
+                continue
+
+            base, pid, suffix = file_name.rsplit(".", 2)
+            if not pid.isdigit() or pid_alive(int(pid)):
+                continue
+
+            path = os.path.join(self.spill_dir, file_name)
+            try:
+                if "." + suffix == CLAIMED_SUFFIX:
+                    os.rename(path, os.path.join(self.spill_dir, base))
+                else:
+                    os.remove(path)
+            except OSError:
+                # reclaimed by another process
+                continue
+
+    def __load_spilled(self):
+        """
+            Moves spilled images back into the queue while there is room. A
+            file is claimed by renaming it, so several processes can share
+            the spill directory without uploading an image twice.
+        """
+        self.__reclaim_dead()
+        for file_name in self.__spilled_files():
+            if self.__queue.full():
+                return
+
+            path = os.path.join(self.spill_dir, file_name)
+            claimed = path + "." + str(os.getpid()) + CLAIMED_SUFFIX
+            try:
+                os.rename(path, claimed)
+                with open(claimed, "rb") as spill_file:
+                    data = spill_file.read()
+                os.remove(claimed)
+            except OSError:
+                # claimed by another process
+                continue
+
+            try:
+                self.__queue.put_nowait((unquote(file_name), data))
+            except queue.Full:
+                self.__spill(unquote(file_name), data)
+                return
+
+    def __spill_queue(self):
+        """
+            Spills the images left in the queue and the batch being uploaded,
+            called when the process exits. An image of the batch may also be
+            uploaded before the process ends, it is then uploaded again under
+            the same name.
+        """
+        with self.__lock:
+            in_flight = list(self.__in_flight.items())
+            self.__in_flight.clear()
+
+        for name, data in in_flight:
+            self.__spill(name, data)
+
+        while True:
+            try:
+                name, data = self.__queue.get_nowait()
+            except queue.Empty:
+                return
+
+            self.__spill(name, data)
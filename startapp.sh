@@ -7,6 +7,8 @@ nworkers=$(((2*$ncores)+1))
 if [[ $nworkers -gt 12 ]]; then
     nworkers=12
 fi
+# Threads per worker, long-lived high score streams occupy one thread each
+nthreads=8
 
 # Get console width
 cols=$(tput cols)
@@ -20,7 +22,8 @@ Options:
                     number of workers set to 1,
                     and only 127.0.0.1 is exposed.
     -w, --workers   Specify number of gunicorn workers,
-                    recommended values are 3-12 workers.'
+                    recommended values are 3-12 workers.
+    --threads       Specify number of threads per worker.'
 
 # print headline with text. Optional first argument determines color.
 printHeadline() {
@@ -79,38 +82,57 @@ while [[ "$#" -gt 0 ]]; do
         -t | --test)        runTests;
                             exit 0;;
         -d | --debug)       debug=true;
+                            export DEBUG=true;
                             nworkers=1;
                             shift;;
         -w=* | --workers=*) nworkers="${1#*=}";
                             shift;;
+        --threads=*)        nthreads="${1#*=}";
+                            shift;;
         *)                  echo "Unexpected option: $1, use -h for help";
                             exit 1;;
     esac
 done
 
+# One database connection per thread, and overflow for background threads
+export DB_POOL_SIZE=${DB_POOL_SIZE:-$nthreads}
+export DB_MAX_OVERFLOW=${DB_MAX_OVERFLOW:-4}
+dbconnections=$(($nworkers*($DB_POOL_SIZE+$DB_MAX_OVERFLOW)))
+# Half of the threads may serve high score streams, the rest the game
+export SSE_MAX_STREAMS=${SSE_MAX_STREAMS:-$(($nthreads/2))}
+
 # Print some info
 printHeadline 'Teknisk Museum backend'
 echo "$(python --version)
 $(which python)
 Number processing units: $ncores
-Number of workers: $nworkers"
+Number of workers: $nworkers
+Number of threads per worker: $nthreads
+Database connections per worker: $DB_POOL_SIZE (+$DB_MAX_OVERFLOW overflow)
+Maximum database connections: $dbconnections
+High score streams per worker: $SSE_MAX_STREAMS"
+
+# Create tables, seed labels and store the CV iteration once per deployment,
+# before gunicorn forks the workers. DEBUG is already exported in debug mode,
+# so the test database used by the server is initialized.
+printline
+(cd src/ && python -m webapp.init) || exit 1
 
 # Default settings and entry point to flask
-default_settings="--timeout=600 -w=$nworkers --chdir src/ webapp.api:app"
+default_settings="--timeout=600 -w=$nworkers --worker-class=gthread --threads=$nthreads --chdir src/ webapp.api:app"
 logfile='/home/LogFiles/flaskapp.log'
 
 if [[ $debug = true ]]; then
     printHeadline red 'Debug mode'
     echo 'Debug mode activated. Gunicorn is reloaded on code changes.'
-    export DEBUG=true
     printline
     gunicorn --reload $default_settings
 elif [[ $IS_PRODUCTION = true ]]; then
-    gunicorn --bind=0.0.0.0 --log-file=$logfile $default_settings
+    gunicorn --bind=0.0.0.0 --log-file=$logfile --preload $default_settings
     echo "Logs written to: $logfile"
 else
     printline
-    gunicorn --bind=0.0.0.0 $default_settings
+    gunicorn --bind=0.0.0.0 --preload $default_settings
 fi
 
 printline